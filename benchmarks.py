@@ -0,0 +1,185 @@
+"""
+File: benchmarks.py
+---
+Times each stage of the musical pattern sequencer on representative inputs
+and prints the results as JSON, so runs from different releases can be compared.
+
+Usage: python benchmarks.py [--repeat N] [--output FILE] [--lilypond]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import musicalpatternsequencer as mps
+
+# Patterns covering the plain, triplet, quintuplet and septuplet paths of determine_rhyth_val
+PATTERNS = {
+    "short": [1, 2, 3, 5],
+    "triplet": [1, 3, 5],
+    "quintuplet": [1, 2, 3, 4, 5],
+    "septuplet": [1, 2, 3, 4, 5, 6, 7],
+    "long": [1, 3, 2, 4, 3, 5, 4, 6, 5, 7, 6, 1]
+}
+
+SCALES = ["major", "chromatic"]
+
+# Modules to time importing, from the lightweight core up to the command line
+MODULES = ["musicalpatternsequencer", "sequencer_lilypond", "sequencer_compile", "sequencer_cli"]
+
+
+def ly_script_inputs(name_of_scale, pattern):
+    """
+    Prepares the arguments of make_ly_script for a scale and pattern.
+    Returns: scale, motif, rhythm value and key quality, as passed to make_ly_script [tuple]
+    """
+    scale = mps.ALLOWED_SCALES[name_of_scale]
+    key_sig_qual = mps.get_key(name_of_scale)
+    motif = mps.int_seq_to_letters(mps.pattern_on_scale(scale, pattern), key_sig_qual)
+    return (mps.int_seq_to_letters(scale, key_sig_qual), motif,
+            mps.determine_rhyth_val(pattern), key_sig_qual)
+
+
+def time_call(function, repeat):
+    """
+    Times a function with timeit, choosing the number of calls per run automatically.
+    Returns: number of calls per run, and the best and median time per call in seconds [dict]
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    timings = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {"number": number, "best": min(timings), "median": statistics.median(timings)}
+
+
+def benchmark_cases():
+    """
+    Yields the generation benchmarks: (stage, parameters, function to time) [tuple]
+    """
+    for name_of_scale in SCALES:
+        scale = mps.ALLOWED_SCALES[name_of_scale]
+        yield "generate_modes", {"scale": name_of_scale}, lambda scale=scale: mps.generate_modes(scale)
+
+        for pattern_name, pattern in PATTERNS.items():
+            if max(pattern) > len(scale):
+                continue
+            params = {"scale": name_of_scale, "pattern": pattern_name}
+            yield ("pattern_on_scale", params,
+                   lambda scale=scale, pattern=pattern: mps.pattern_on_scale(scale, pattern))
+
+            scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual = ly_script_inputs(
+                name_of_scale, pattern)
+            for modes in (False, True):
+                settings = {"modes": modes}
+                yield ("make_ly_script", dict(params, modes=modes),
+                       lambda args=(scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual,
+                                    name_of_scale, settings): mps.make_ly_script(*args))
+                yield ("make_midi", dict(params, modes=modes),
+                       lambda args=(name_of_scale, pattern, settings): mps.make_midi(*args))
+                yield ("make_musicxml", dict(params, modes=modes),
+                       lambda args=(name_of_scale, pattern, settings): mps.make_musicxml(*args))
+
+
+def benchmark_lilypond(repeat):
+    """
+    Times run_lilypond on a short and a long book.
+    Each run is timed once, since a single Lilypond run takes seconds.
+    Returns: one result per book [list of dicts]
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name_of_scale, pattern_name, modes in (("major", "short", False),
+                                                   ("chromatic", "long", True)):
+            filename = os.path.join(work_dir, "bench.ly")
+            mps.atomic_write(filename, mps.generate_ly_script(
+                name_of_scale, PATTERNS[pattern_name], {"modes": modes}))
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                status = mps.run_lilypond(filename)["status"]
+                timings.append(time.perf_counter() - start)
+            results.append({"stage": "run_lilypond", "status": status,
+                            "params": {"scale": name_of_scale, "pattern": pattern_name,
+                                       "modes": modes},
+                            "number": 1, "best": min(timings),
+                            "median": statistics.median(timings)})
+    return results
+
+
+def benchmark_imports(repeat):
+    """
+    Times importing each module in a fresh interpreter, as on a cold start.
+    The time to start an interpreter that imports nothing is subtracted.
+    Returns: one result per module [list of dicts]
+    """
+    def run(code):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    baseline = min(run("pass"))
+    results = []
+    for module in MODULES:
+        timings = [timing - baseline for timing in run("import " + module)]
+        results.append({"stage": "import", "params": {"module": module}, "number": 1,
+                        "best": min(timings), "median": statistics.median(timings)})
+    return results
+
+
+def run_benchmarks(repeat = 5, lilypond = False):
+    """
+    Runs every benchmark.
+    Parameters:
+    -repeat: number of timed runs per benchmark [int]
+    -lilypond: whether to include run_lilypond, which needs Lilypond installed [bool]
+    Returns: report with environment details and results [dict]
+    """
+    results = []
+    for stage, params, function in benchmark_cases():
+        results.append(dict({"stage": stage, "params": params}, **time_call(function, repeat)))
+    results.extend(benchmark_imports(repeat))
+
+    if lilypond:
+        if os.path.exists(mps.LILYPOND_PATH):
+            results.extend(benchmark_lilypond(max(1, repeat // 2)))
+        else:
+            results.append({"stage": "run_lilypond", "status": "skipped",
+                            "reason": mps.LILYPOND_PATH + " not found"})
+
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "lilypond_version": mps.LILYPOND_VERSION,
+            "repeat": repeat,
+            "results": results}
+
+
+def main(argv):
+    """
+    Runs the benchmarks and writes the report.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the musical pattern sequencer.")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--output", help="write the JSON report to a file instead of stdout")
+    parser.add_argument("--lilypond", action="store_true", help="also time run_lilypond")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run_benchmarks(args.repeat, args.lilypond), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+"""
+File: golden_corpus.py
+---
+Checks that the generated Lilypond scripts still match the golden copies in golden/,
+and measures how many scripts per second the generator produces, so changes made
+for speed cannot quietly change the engraved music.
+
+The jobs are listed in golden/corpus.csv (the batch manifest format), covering every scale,
+the plain, triplet, quintuplet and septuplet rhythms, patterns that do not start
+on degree 1, and books with and without modes.
+
+Usage: python golden_corpus.py [--update] [--repeat N] [--corpus DIR]
+"""
+import argparse
+import difflib
+import os
+import sys
+import time
+
+import musicalpatternsequencer as mps
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+MANIFEST = "corpus.csv"
+DIFF_LINES = 20 # Lines of each difference to print
+
+
+def load_corpus(corpus_dir):
+    """
+    Reads the jobs of the corpus.
+    Parameter: folder holding corpus.csv and the golden scripts [string]
+    Returns: jobs, each with keys name, scale, pattern and settings [list of dicts]
+    """
+    return mps.read_manifest(os.path.join(corpus_dir, MANIFEST))
+
+
+def generate(job):
+    """
+    Generates the Lilypond script of a job.
+    Returns: full Lilypond script [string]
+    """
+    return mps.generate_ly_script(job["scale"], job["pattern"], job["settings"])
+
+
+def check_corpus(jobs, corpus_dir):
+    """
+    Compares the script of each job with its golden copy.
+    Returns: job name and a unified diff for each script that differs or has
+    no golden copy [list of tuples]
+    """
+    failures = []
+    for job in jobs:
+        golden_file = os.path.join(corpus_dir, job["name"] + ".ly")
+        if not os.path.exists(golden_file):
+            failures.append((job["name"], ["no golden copy: " + golden_file + "\n"]))
+            continue
+        with open(golden_file, encoding="utf-8") as f:
+            expected = f.read()
+        actual = generate(job)
+        if actual != expected:
+            failures.append((job["name"], list(difflib.unified_diff(
+                expected.splitlines(True), actual.splitlines(True),
+                "golden/" + job["name"] + ".ly", "generated"))))
+    return failures
+
+
+def update_corpus(jobs, corpus_dir):
+    """
+    Rewrites the golden copies from the current generator.
+    Only do this after checking that the differences are intended.
+    """
+    for job in jobs:
+        mps.atomic_write(os.path.join(corpus_dir, job["name"] + ".ly"), generate(job))
+
+
+def measure_throughput(jobs, repeat):
+    """
+    Times generating every script of the corpus, taking the best of several runs.
+    Returns: scripts and characters generated per second [dict]
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chars = sum(len(generate(job)) for job in jobs)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {"documents": len(jobs), "seconds": best,
+            "documents_per_second": len(jobs) / best, "chars_per_second": chars / best}
+
+
+def main(argv):
+    """
+    Checks the corpus and reports the throughput.
+    Returns: exit status, 1 if any script differs from its golden copy [int]
+    """
+    parser = argparse.ArgumentParser(description="Check generated scripts against the golden corpus.")
+    parser.add_argument("--update", action="store_true",
+                        help="rewrite the golden copies from the current generator")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs for the throughput")
+    parser.add_argument("--corpus", default=CORPUS_DIR, help="folder holding corpus.csv")
+    args = parser.parse_args(argv)
+
+    jobs = load_corpus(args.corpus)
+    if args.update:
+        update_corpus(jobs, args.corpus)
+        print("Updated " + str(len(jobs)) + " golden scripts in " + args.corpus + ".")
+        return 0
+
+    failures = check_corpus(jobs, args.corpus)
+    for name, diff in failures:
+        print(name + " differs from its golden copy:")
+        print("".join(diff[:DIFF_LINES]), end="")
+        if len(diff) > DIFF_LINES:
+            print("... (" + str(len(diff) - DIFF_LINES) + " more lines)")
+
+    throughput = measure_throughput(jobs, max(1, args.repeat))
+    print(str(len(jobs) - len(failures)) + " of " + str(len(jobs)) + " scripts match.")
+    print("Throughput: {documents_per_second:.1f} documents/s, {chars_per_second:,.0f} chars/s "
+          "(best of {repeat} runs, {seconds:.3f}s for {documents} documents)".format(
+              repeat=max(1, args.repeat), **throughput))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -11,14 +11,26 @@ This is still at a prototype stage, and a wishlist of extra features appears in
 TODO:
 -Test for very long patterns and how this affects layout
 -Octave displacement issues with Lilypond notation
--Extension: User preview of pattern before generating full PDF
 -Extended user input/settings (ascending/descending, 
 choose output type - PDF, PNG, or code, fine-tuning, etc.)
--Extension: patterns repeated over chord progressions
 -Extension: GUI input
 -Extension: bundled version that copies to clipboard, then opens browser to hacklily.org
+
+Batch mode: passing a manifest on the command line skips the prompts and renders
+every job in it, e.g. python musicalpatternsequencer.py --manifest jobs.csv
+
+This module is the core: the scale and key tables and the pattern calculations,
+which import almost nothing so they load quickly. The rest of the program lives in
+sequencer_lilypond (Lilypond scripts), sequencer_compile (running Lilypond),
+sequencer_tracing (metrics) and sequencer_cli (prompts and batch mode). Their names
+can also be used from here, e.g. musicalpatternsequencer.make_ly_script;
+each module is only imported the first time one of its names is used.
 """
-import subprocess
+import importlib
+import itertools
+import struct
+import sys
+import types
 
 ALLOWED_SCALES = {
     "major": [0, 2, 4, 5, 7, 9, 11],
@@ -30,175 +42,105 @@ ALLOWED_SCALES = {
 }
 
 ALLOWED_PROGRESSIONS = {
-    "circle of fifths":[0, 7, 2, 9, 4, 11, 6, 1, 8, 3, 10, 5]
+    "circle of fifths":[0, 7, 2, 9, 4, 11, 6, 1, 8, 3, 10, 5],
+    "ii-V-I": ["Dm7", "G7", "Cmaj7"],
+    "blues": ["C7", "F7", "C7", "C7", "F7", "F7", "C7", "C7", "G7", "F7", "C7", "G7"],
+    "coltrane changes": ["Cmaj7", "Eb7", "Abmaj7", "B7", "Emaj7", "G7", "Cmaj7"]
 }
 
-FLATS_CONVERSION = ("C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B")
-SHARPS_CONVERSION = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
-KEYS_CONVERSION = ("C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B")
-
-
-# ---User input-related functions---
-def welcome_message():
-    """
-    Displays an opening message.
-    """
-    welcome_text = """
-    ---------------------
-    - MUSICAL SEQUENCER -
-    ---------------------
-    This program repeats a pattern of scale degrees (e.g., 1-2-3-5) starting on each note of a scale.
-    This will be transposed through all twelve keys around the circle of fifths.
-    """
-    print(welcome_text)
-
-
-def basic_input():
-    """
-    User inputs core elements (scale and pattern) to be sequenced 
-    and returns these to the main function
-    Returns:
-    -user_scale: scale in letter format [list]
-    -user_scale_name: name of scale [string]
-    -user_pattern: scale degree pattern [list]
-    -settings: advanced settings [dict]
-    """
-    user_scale, user_scale_name = input_scale()
-    user_pattern = input_pattern(user_scale)
-    settings = advanced_settings()
+# Scale played over each chord quality, as in chord symbols like "Dm7" (see parse_chord)
+CHORD_SCALES = {
+    "": [0, 2, 4, 5, 7, 9, 11], # Major (ionian)
+    "maj7": [0, 2, 4, 5, 7, 9, 11], # Major (ionian)
+    "7": [0, 2, 4, 5, 7, 9, 10], # Mixolydian
+    "m": [0, 2, 3, 5, 7, 8, 10], # Natural minor (aeolian)
+    "m7": [0, 2, 3, 5, 7, 9, 10], # Dorian
+    "m7b5": [0, 1, 3, 5, 6, 8, 10] # Locrian
+}
 
-    print(user_scale_name.capitalize(), "scale:", user_scale)
-    print("Pattern:", user_pattern)
-    return user_scale, user_scale_name, user_pattern, settings
+# Names of the chord qualities, also used for the motif variables in LY scripts
+CHORD_NAMES = {
+    "": "major",
+    "maj7": "major seventh",
+    "7": "dominant seventh",
+    "m": "minor",
+    "m7": "minor seventh",
+    "m7b5": "half diminished"
+}
 
+FLATS_CONVERSION = ("C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B")
 
-def input_scale():
-    """
-    User inputs a scale
-    Checks for valid inputs
-    Returns:
-    -user_scale as integer notation [list]
-    -user_scale_string [string]
-    """
-    unkn_scale = "Hmm, I don't know that scale. "
-    init_options = "Enter 'major' or 'minor': "
-    min_options = "Enter 'natural minor', 'melodic minor', or 'harmonic minor': "
-
-    init_valid_inputs = ALLOWED_SCALES.keys()
-    min_valid_inputs = ["natural minor", "melodic minor", "harmonic minor"]
-    print("First, let's select a scale.")
-
-    # Checks for valid inputs
-    user_scale_string = check_input_valid("What type of scale would you like to use? " +
-                      init_options, init_valid_inputs, unkn_scale)
-
-    # Specifies type of minor scale and checks for valid inputs
-    if user_scale_string == 'minor':
-        user_scale_string = check_input_valid("Which type of minor? " + min_options,
-                                              min_valid_inputs, unkn_scale)
-
-    # TBD Enable custom scale entry; use if-else structure with allowable list code below
-    # elif user_scale_string == 'custom':
-    #     print("Not yet implemented. Defaulting to major scale.")
-    #     user_scale = ALLOWED_SCALES["major"]
-
-    # Determine scale setup from allowable list
-    user_scale = ALLOWED_SCALES[user_scale_string]
-    print("\nOK, a " + str(user_scale_string) + " scale (" + str(user_scale) + ").\n")
-    return user_scale, user_scale_string
-
-
-def input_pattern(scale):
-    """
-    User enters a pattern and checks validity of entry
-    Parameter: scale as integer notation [list]
-    Returns: pattern as integer notation [list]
-    """
-    input_message = "Enter a series of scale degrees (e.g., 1 2 3 5) with spaces in-between: "
-    print("Next, let's set up a pattern to be repeated across the scale.")
-    print("Note that your scale has " + str(len(scale)) + " scale degrees.")
-    user_input_pattern = []
-
-    # Verify user input for 4 cases: no entry, non-int, negative int, and # greater than # in scale
-    user_input_pattern = [try_int(item) for item in input(input_message).split()]
-    print(user_input_pattern)
-    while (not user_input_pattern or
-            user_input_pattern.count(None) != 0 or
-            max(user_input_pattern) > len(scale) or
-            min(user_input_pattern) <= 0 or
-            len(user_input_pattern) == 1):
-        if not user_input_pattern: # Checks if list is empty; aka user did not input anything
-            print("You haven't entered anything. Try again.")
-        elif user_input_pattern.count(None) != 0: # Checks if non-int
-            print ("Hmm, that's not a number. Try again.")
-        elif max(user_input_pattern) > len(scale):
-            print("Hmm, you've included a scale degree bigger than your scale. Try again.")
-        elif min(user_input_pattern) <= 0:
-            print("Hmm, scale degrees have to be positive numbers. Try again.")
-        elif len(user_input_pattern) == 1:
-            print("Your pattern needs more than one note. Try again.")
-        user_input_pattern = [try_int(item) for item in input(input_message).split()]
-
-    # Display pattern back to user
-    print("\nOK, your pattern is " + str(user_input_pattern) + ".\n")
-    return user_input_pattern
-
-
-def advanced_settings():
-    """
-    User inputs advanced settings.
-    Returns settings [dict]
-    """
-    valid_inputs = ["y", "n"]
-
-    # Sets default settings
-    settings = {
-        "modes" : False
-    }
-    enter_settings = check_input_valid("Enter advanced settings (y/n)? ", valid_inputs)
-    if enter_settings == "n":
-        return settings
-    else:
-        print("\n" + "---Advanced settings---" + "\n"
-            )
+SHARPS_CONVERSION = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
 
-        settings["modes"] = check_input_valid("Generate all modes of scale (y/n)? ", valid_inputs)
+KEYS_CONVERSION = ("C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B")
 
-        # Convert to bools
-        for option in settings:
-            if settings[option] == "y":
-                settings[option] = True
-            else:
-                settings[option] = False
+# Letter names used for each key signature quality (see int_seq_to_letters)
+KEY_SPELLINGS = {
+    "major": FLATS_CONVERSION,
+    "minor": KEYS_CONVERSION,
+    "custom": FLATS_CONVERSION
+}
 
-        print("---") # Section separator for clarity
-        return settings
+# Conversions between letter names ("Bb"), LY names ("bf") and LY markup text,
+# worked out once here so conversion functions are simple lookups
+LETTER_TO_LY = types.MappingProxyType({
+    letter: letter[0].lower() + letter[1:].replace("b", "f").replace("#", "s")
+    for letter in set(FLATS_CONVERSION + SHARPS_CONVERSION + KEYS_CONVERSION)
+})
+
+LY_TO_LETTER = types.MappingProxyType({ly: letter for letter, ly in LETTER_TO_LY.items()})
+
+LY_TO_TEXT = types.MappingProxyType({
+    ly: ("\\concat{" + ly[0].upper() + "\\super\\sharp}" if ly[1:] == "s" else
+         "\\concat{" + ly[0].upper() + "\\super\\flat}" if ly[1:] == "f" else
+         ly.upper())
+    for ly in LY_TO_LETTER
+})
+
+# Spelling of each pitch class in each key quality: (letter, LY, LY markup text)
+SPELLING_TABLE = types.MappingProxyType({
+    (pitch_class, key_quality): (letters[pitch_class], LETTER_TO_LY[letters[pitch_class]],
+                                 LY_TO_TEXT[LETTER_TO_LY[letters[pitch_class]]])
+    for key_quality, letters in KEY_SPELLINGS.items()
+    for pitch_class in range(12)
+})
+
+LILYPOND_VERSION = "2.24.3"
+LILYPOND_HEADER = '\\version "' + LILYPOND_VERSION + '" '
+
+MIDI_TICKS_PER_QUARTER = 420 # Divides evenly into the 3-, 5- and 7-note tuplets
+MIDI_MIDDLE_C = 60
+
+# Key signature of each major key by letter, in sharps (positive) or flats (negative)
+LETTER_FIFTHS = {"F": -1, "C": 0, "G": 1, "D": 2, "A": 3, "E": 4, "B": 5}
+MUSICXML_NOTE_TYPES = {4: "quarter", 8: "eighth", 16: "16th"} # By rhythmic value
+
+DEFAULT_SETTINGS = {
+    "modes" : False
+}
 
 
-def check_input_valid(prompt, valid_values, error_message = "Invalid input. Try again." + "\n"):
+# ---Pattern validation---
+def check_pattern_valid(pattern, scale):
     """
-    Checks if user input is within 
-    Note that this does not display specific error messages,
-    so it is best used for generic cases.
+    Checks a pattern against the rules for scale degree patterns.
+    Shared by the interactive prompt and batch mode.
     Parameters:
-    -prompt: display message to prompt input [string]
-    -valid_values: valid entries [list]
-    """
-    entry = input(prompt).strip().lower()
-    while entry not in valid_values:
-        print(error_message)
-        entry = input(prompt).strip().lower()
-    return entry
-
-
-def wait_to_proceed():
-    """
-    Prompts the user to continue.
-    Used to pause program before generating more messages.
+    -pattern: pattern in diatonic scale degrees, None for non-int entries [list]
+    -scale: scale in integer notation [list]
+    Returns: error message, or None if the pattern is valid [string]
     """
-    print("Press enter to continue.")
-    input("")
-    print("") # Line break to aid console readability
+    if not pattern: # Checks if list is empty; aka user did not input anything
+        return "You haven't entered anything."
+    elif pattern.count(None) != 0: # Checks if non-int
+        return "Hmm, that's not a number."
+    elif max(pattern) > len(scale):
+        return "Hmm, you've included a scale degree bigger than your scale."
+    elif min(pattern) <= 0:
+        return "Hmm, scale degrees have to be positive numbers."
+    elif len(pattern) == 1:
+        return "Your pattern needs more than one note."
+    return None
 
 
 # ---Functions for converting between formats (integer and letter)---
@@ -210,7 +152,7 @@ def try_int(value):
     try:
         int(value)
         return int(value)
-    except ValueError:
+    except (TypeError, ValueError):
         return None
 
 
@@ -223,15 +165,104 @@ def int_seq_to_letters(sequence, key_type):
     Returns:
     -new_sequence in letter notation [list]
     """
-    new_sequence = []
-    if key_type == "minor":
-        for note in sequence:
-            new_sequence.append(KEYS_CONVERSION[note])
-    else:
-        for note in sequence:
-            new_sequence.append(FLATS_CONVERSION[note])
+    letters = KEY_SPELLINGS.get(key_type, FLATS_CONVERSION)
+    return [letters[note] for note in sequence]
+
+
+def int_seq_to_ly(sequence, key_type):
+    """
+    Converts integer notation straight to LY letter names (c, d, ef, etc.),
+    spelled as in int_seq_to_letters.
+    Returns: sequence in LY format [list]
+    """
+    quality = key_type if key_type in KEY_SPELLINGS else "custom"
+    return [SPELLING_TABLE[(note, quality)][1] for note in sequence]
 
-    return new_sequence
+
+def int_seq_to_ly_text(sequence, key_type):
+    """
+    Converts integer notation straight to LY markup text (e.g., \\concat{E\\super\\flat}),
+    spelled as in int_seq_to_letters.
+    Returns: sequence in LY markup text format [list]
+    """
+    quality = key_type if key_type in KEY_SPELLINGS else "custom"
+    return [SPELLING_TABLE[(note, quality)][2] for note in sequence]
+
+
+# ---Compact note sequences---
+class NoteSequence:
+    """
+    A sequence of pitch classes stored compactly, for keeping large numbers
+    of motifs and scales in memory. The pitch classes are held one per byte
+    (as in motif_table) and the octave and key quality once for the whole sequence; letter names
+    are only worked out when asked for (see letters, ly and ly_text).
+    Sequences compare equal when their pitches and octave match, whatever their spelling,
+    so they can be used in sets and as dict keys to find duplicate motifs.
+    Parameters:
+    -pitches: pitch classes in integer notation [iterable of ints]
+    -key_type: key signature quality used for spelling (major, minor or custom) [string]
+    -octave: octave of the first note, 4 being the octave of middle C [int]
+    """
+    __slots__ = ("pitches", "key_type", "octave")
+
+    def __init__(self, pitches, key_type = "custom", octave = 4):
+        self.pitches = bytes(pitches)
+        self.key_type = key_type
+        self.octave = octave
+
+    @classmethod
+    def from_pattern(cls, scale, pattern, key_type = "custom"):
+        """
+        Builds the motif of a pattern applied to a scale (see pattern_on_scale).
+        """
+        return cls(pattern_on_scale(scale, pattern), key_type)
+
+    def __len__(self):
+        return len(self.pitches)
+
+    def __iter__(self):
+        return iter(self.pitches)
+
+    def __getitem__(self, index):
+        return self.pitches[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, NoteSequence):
+            return NotImplemented
+        return self.octave == other.octave and self.pitches == other.pitches
+
+    def __hash__(self):
+        return hash((self.octave, self.pitches))
+
+    def __repr__(self):
+        return ("NoteSequence(" + repr(list(self.pitches)) + ", " + repr(self.key_type) +
+                ", " + repr(self.octave) + ")")
+
+    def transposed(self, semitones):
+        """
+        Transposes the sequence, keeping its spelling quality.
+        Returns: new sequence [NoteSequence]
+        """
+        return NoteSequence(self.pitches.translate(TRANSPOSE_TABLES[semitones % 12]),
+                            self.key_type, self.octave)
+
+    def letters(self):
+        """
+        Returns: sequence in letter notation, as from int_seq_to_letters [list]
+        """
+        return int_seq_to_letters(self.pitches, self.key_type)
+
+    def ly(self):
+        """
+        Returns: sequence in LY format, as from int_seq_to_ly [list]
+        """
+        return int_seq_to_ly(self.pitches, self.key_type)
+
+    def ly_text(self):
+        """
+        Returns: sequence in LY markup text format, as from int_seq_to_ly_text [list]
+        """
+        return int_seq_to_ly_text(self.pitches, self.key_type)
 
 
 # ---Functions for generating melodic sequence---
@@ -263,8 +294,12 @@ def determine_rhyth_val(pattern):
 def get_key(name_of_scale):
     """
     Determines the type of key signature.
-    Returns: key type ("major" or "minor") [string]
+    Scales in the registry (see register_scale) keep the quality they were registered with.
+    Returns: key type ("major", "minor" or "custom") [string]
     """
+    info = SCALE_REGISTRY.get(name_of_scale)
+    if info is not None:
+        return info["key_quality"]
     if name_of_scale == "major":
         return "major"
     elif "minor" in name_of_scale:
@@ -286,25 +321,21 @@ def pattern_on_scale(scale, pattern):
     -motif: motif/pattern in integer notation applied to the start of the scale [list]
     """
 
-    motif = []
-    diatonic_interval_shifts = []
+    # Make first iteration of the pattern, applied to the scale
+    # (finds the index in the scale of each note to add)
+    return [scale[(scale[0] + shift) % len(scale)] for shift in diatonic_interval_shifts(pattern)]
+
 
+def diatonic_interval_shifts(pattern):
+    """
+    Calculates the amount to shift each note of the pattern by diatonically,
+    relative to the first note of the pattern.
+    Parameter: pattern in diatonic scale degrees [list]
+    Returns: number of scale indices to move along for each note [list]
+    """
     # Handles case for pattern that does not start on scale degree 1.
     starting_degree_shift = determine_start_deg_shift(pattern)
-
-    # Calculate amount to shift each note by diatonically, relative to the first note of the pattern
-    for i in range(len(pattern)):
-        diatonic_interval_shift = pattern[i] - pattern[0] + starting_degree_shift
-        diatonic_interval_shifts.append(diatonic_interval_shift)
-
-    # Make first iteration of the pattern, applied to the scale
-    for i in range(len(pattern)):
-        # Finds the index in the scale of the next note to add
-        next_note_index = (scale[0] + diatonic_interval_shifts[i]) % len(scale)
-        motif.append(scale[next_note_index])
-        next_note_index = 0
-
-    return motif
+    return [degree - pattern[0] + starting_degree_shift for degree in pattern]
 
 
 def determine_start_deg_shift(pattern):
@@ -329,12 +360,7 @@ def generate_modes(scale):
     Returns:
     -modes in integer notation [list of lists]
     """
-    all_modes = []
-    next_mode = scale[:] # Makes a copy of list to avoid overwrite
-    for note in scale:
-        all_modes.append(next_mode)
-        next_mode = modal_rotation(next_mode[:]) # Makes a copy of list to avoid overwrite
-    return all_modes
+    return [scale[i:] + scale[:i] for i in range(len(scale))]
 
 
 def modal_rotation(scale):
@@ -344,274 +370,496 @@ def modal_rotation(scale):
     -ly_scale: scale in any format (integer, letter, Lilypond) [list]
     Returns rotated scale on next mode in same format [list]
     """
-    first_note = scale.pop(0)
-    scale.append(first_note)
-    return scale
+    return scale[1:] + scale[:1]
 
 
-# ---Lilypond-related conversion functions---
-def ly_scale_to_sequence(scale):
-    """
-    Generates a string in Lilypond format for the main melodic sequence of the program.
-    Uses the modal transpose feature in Lilypond.
-    Parameter:
-    -scale_list: scale as letter names in LY format [list]
-    Output: returns melody string in LY format [string]
-    """
-    from_pitch = 'c'
-    lilyp_single_seq = ""
-
-    # Iterating along each note in the scale to repeat the motif
-    for note in scale:
-        to_pitch = note
-        lilyp_single_seq += ('\\modalTranspose ' + str(from_pitch) + " " + str(to_pitch) +
-                              ' \\diatonicScale \\motif \n')
+# ---Functions for computing many patterns at once---
+# Motifs are held as bytes of pitch classes (0-11), so moving a motif to another mode
+# or key is a single bytes.translate() through one of these 256-entry tables.
+TRANSPOSE_TABLES = tuple(bytes((value + key) % 12 for value in range(256)) for key in range(12))
 
-    lilyp_single_seq += "\n}" # Final line break for LY legibility
 
-    return lilyp_single_seq
-
-
-def lett_list_to_ly_list (melody):
+def mode_tables(scale):
     """
-    Turns a given melody (in list, letter/LY format) into a list in Lilypond format
-    Can be applied repeatedly as a check without changing LY format
-    Parameters: melody as letter names in standard/LY letter format [list]
-    Output: melody as LY format [list]
+    Builds the translation tables that map diatonic interval shifts to pitch classes,
+    one for the motif starting on each degree of the scale (i.e., each mode).
+    Parameter: scale in integer notation [list]
+    Returns: one 256-entry table per mode [tuple of bytes]
     """
-    new_melody = []
-
-    for note in melody:
-        new_melody.append(lett_to_ly(note))
-
-    return new_melody
+    return tuple(bytes(scale[(mode + index) % len(scale)] for index in range(256))
+                 for mode in range(len(scale)))
 
 
-def ly_add_slur(melody):
+def motif_table(scale, pattern, keys = None, tables = None):
     """
-    Adds LY slur notation to a given list
-    Parameter:
-    -melody: a melody in LY notation [list]
-    Returns:
-    -melody in LY notation with slurs [list]  
+    Computes the motif of a pattern starting on every degree of a scale (every mode),
+    transposed to every key, without any Lilypond or letter conversion.
+    Mode 1 in the key of C is the motif from pattern_on_scale.
+    Parameters:
+    -scale: scale in integer notation [list]
+    -pattern: pattern in diatonic scale degrees [list]
+    -keys: keys to transpose to in integer notation,
+    defaults to the circle of fifths [list]
+    -tables: mode tables of the scale from mode_tables, to reuse across patterns [tuple]
+    Returns: motifs as bytes of pitch classes, indexed [mode][key] [tuple of tuples]
     """
-    new_melody = melody
-    new_melody.insert(1, "(")
-    new_melody.append(")")
-    return new_melody
-
+    if keys is None:
+        keys = ALLOWED_PROGRESSIONS["circle of fifths"]
+    if tables is None:
+        tables = mode_tables(scale)
+    shifts = bytes(shift % len(scale) for shift in diatonic_interval_shifts(pattern))
 
-def ly_to_lett(note):
-    """
-    Converts a given note from Lilypond letter format to standard letter format
-    E.g., "bf" -> "Bb"
-    Can be repeatedly applied without issues.
-    Parameter: note in LY format ("bf") [string]
-    Returns converted note in standard letter ("Bb") [string]
-    """
-    note = note.capitalize()
-    note = note.replace("f", "b")
-    note = note.replace("s", "#")
-    return note
+    return tuple(tuple(motif.translate(TRANSPOSE_TABLES[key]) for key in keys)
+                 for motif in (shifts.translate(table) for table in tables))
 
 
-def lett_to_ly(note):
+def pattern_space(scales, patterns, keys = None):
     """
-    Converts a given note from standard letter format to Lilypond letter format
-    E.g., "Bb" -> "bf"
-    Parameter: note in standard or LY letter format ("Bb") [string]
-    Returns converted note in LY format ("bf") [string]
-    """
-    note = note.capitalize() # Added element to handle LY input
-    if note.endswith("b") and note != "b":
-        note = note.replace("b", "f")
-    note = note.replace("#", "s")
-    note = note.lower()
-    return note
+    Computes motif_table for every combination of scale and pattern.
+    Patterns that are not valid for a scale (see check_pattern_valid) are skipped.
+    Results are yielded one at a time so very large batches are not held in memory.
+    Parameters:
+    -scales: scale names and scales in integer notation, e.g. ALLOWED_SCALES [dict]
+    -patterns: patterns in diatonic scale degrees [iterable of lists]
+    -keys: keys to transpose to in integer notation, defaults to the circle of fifths [list]
+    Yields: (scale name, pattern, motif table) [tuple]
+    """
+    patterns = [tuple(pattern) for pattern in patterns]
+    for name_of_scale, scale in scales.items():
+        info = SCALE_REGISTRY.get(name_of_scale)
+        # Registered scales have their mode tables worked out already
+        tables = (info["mode_tables"] if info is not None and info["scale"] == tuple(scale)
+                  else mode_tables(scale))
+        for pattern in patterns:
+            if check_pattern_valid(list(pattern), scale) is None:
+                yield name_of_scale, pattern, motif_table(scale, pattern, keys, tables)
+
+
+# ---Scale registry---
+# Derived data of each scale (see register_scale), by name. Custom scales are worked out
+# when they are registered; the scales of ALLOWED_SCALES the first time scale_info is asked.
+SCALE_REGISTRY = {}
+
+
+def check_scale_valid(scale):
+    """
+    Checks a scale given by the user, e.g. for register_scale.
+    Parameter: scale in integer notation, None for non-int entries [list]
+    Returns: error message, or None if the scale is valid [string]
+    """
+    if not scale:
+        return "You haven't entered anything."
+    elif scale.count(None) != 0:
+        return "Hmm, that's not a number."
+    elif len(scale) < 2:
+        return "Your scale needs more than one note."
+    elif scale[0] != 0:
+        return "Hmm, scales have to start on 0 (the root)."
+    elif max(scale) > 11:
+        return "Hmm, notes are counted in semitones above the root, from 0 to 11."
+    elif any(note <= previous for previous, note in zip(scale, scale[1:])):
+        return "Hmm, the notes have to go up, without repeats."
+    return None
+
+
+def register_scale(name_of_scale, scale, key_quality = None):
+    """
+    Adds a scale to ALLOWED_SCALES (e.g. bebop or a mode of melodic minor), after checking it,
+    and works out everything that depends only on the scale, so patterns over it are lookups:
+    its modes, mode tables (see mode_tables), key quality, and its notes and spelling in every key.
+    Registering the same scale again returns the stored data; registering a name already
+    in use with other notes or another key quality raises ValueError.
+    Parameters:
+    -name_of_scale: name of the scale, e.g. "bebop dominant" [string]
+    -scale: scale in integer notation, starting on 0, e.g. [0, 2, 4, 5, 7, 9, 10, 11] [list]
+    -key_quality: key signature quality, a key of KEY_SPELLINGS;
+    defaults to get_key's guess from the name [string]
+    Returns: the scale's data, with keys name, scale, key_quality, modes, mode_tables,
+    transpositions and spellings (both by key in integer notation) [mapping]
+    """
+    name_of_scale = name_of_scale.strip().lower()
+    scale = tuple(scale)
+    if not name_of_scale:
+        raise ValueError("The scale needs a name.")
+    error = check_scale_valid(list(scale))
+    if error is not None:
+        raise ValueError(error)
+    if key_quality is None:
+        key_quality = get_key(name_of_scale)
+    if key_quality not in KEY_SPELLINGS:
+        raise ValueError("Unknown key quality: " + str(key_quality))
+
+    # A name already in use keeps its scale and key quality, built-in scales included
+    info = SCALE_REGISTRY.get(name_of_scale)
+    if info is not None:
+        if info["scale"] == scale and info["key_quality"] == key_quality:
+            return info
+        raise ValueError("There is already a scale called " + name_of_scale + ".")
+    if name_of_scale in ALLOWED_SCALES and (tuple(ALLOWED_SCALES[name_of_scale]) != scale or
+                                            key_quality != get_key(name_of_scale)):
+        raise ValueError("There is already a scale called " + name_of_scale + ".")
+
+    transpositions = {key: bytes(scale).translate(TRANSPOSE_TABLES[key]) for key in range(12)}
+    info = types.MappingProxyType({
+        "name": name_of_scale,
+        "scale": scale,
+        "key_quality": key_quality,
+        "modes": tuple(tuple(mode) for mode in generate_modes(list(scale))),
+        "mode_tables": mode_tables(scale),
+        "transpositions": types.MappingProxyType(transpositions),
+        "spellings": types.MappingProxyType({
+            key: tuple(int_seq_to_letters(notes, key_quality))
+            for key, notes in transpositions.items()})
+    })
+    ALLOWED_SCALES[name_of_scale] = list(scale)
+    SCALE_REGISTRY[name_of_scale] = info
+    return info
+
+
+def scale_info(name_of_scale):
+    """
+    Looks up the derived data of a scale (see register_scale).
+    Parameter: the full name of the scale, a key of ALLOWED_SCALES [string]
+    Returns: the scale's data [mapping]
+    """
+    info = SCALE_REGISTRY.get(name_of_scale)
+    if info is None:
+        info = register_scale(name_of_scale, ALLOWED_SCALES[name_of_scale])
+    return info
+
+
+# ---Functions for enumerating patterns---
+def iter_patterns(scale, length, dedupe = False, start_degree = None, max_leap = None,
+                  allow_repeats = True, predicate = None):
+    """
+    Yields every valid pattern of a given length for a scale, one at a time,
+    following the same rules as input_pattern (see check_pattern_valid).
+    Patterns are generated lazily, so the full combinatorial space is never held in memory.
+
+    With dedupe, patterns that differ only by a diatonic shift (e.g., 1 2 3 and 2 3 4)
+    are yielded once. pattern_on_scale moves every note by the same starting degree shift,
+    and the motif is then repeated from every degree of the scale, so such patterns
+    produce the same set of motifs. Each class is represented by its member whose lowest
+    degree is 1 (e.g., 4 3 2 1 for 5 4 3 2), which needs no record of patterns already seen.
+    With start_degree, each class already has at most one pattern to yield.
+    Parameters:
+    -scale: scale in integer notation [list]
+    -length: number of notes in each pattern, at least 2 [int]
+    -dedupe: yield one pattern per class of diatonically shifted patterns [bool]
+    -start_degree: only yield patterns starting on this degree [int]
+    -max_leap: largest allowed step between consecutive degrees [int]
+    -allow_repeats: whether a degree may be repeated straight away (e.g., 1 1 2) [bool]
+    -predicate: extra filter, called with each pattern [function]
+    Yields: pattern in diatonic scale degrees [list]
+    """
+    if length < 2:
+        return
+    degrees = range(1, len(scale) + 1)
+    lowest_on_root = dedupe and start_degree is None
+    first_degrees = degrees if start_degree is None else [start_degree]
+
+    for first_degree in first_degrees:
+        for rest in itertools.product(degrees, repeat=length - 1):
+            pattern = [first_degree, *rest]
+            if lowest_on_root and min(pattern) != 1:
+                continue
+            steps = [abs(note - previous) for previous, note in zip(pattern, pattern[1:])]
+            if max_leap is not None and max(steps) > max_leap:
+                continue
+            if not allow_repeats and min(steps) == 0:
+                continue
+            if predicate is not None and not predicate(pattern):
+                continue
+            yield pattern
+
+
+def iter_pattern_space(scale, max_length, min_length = 2, **filters):
+    """
+    Yields every valid pattern for a scale from min_length up to max_length notes,
+    shortest first. Takes the same filters as iter_patterns.
+    """
+    for length in range(max(min_length, 2), max_length + 1):
+        yield from iter_patterns(scale, length, **filters)
+
+
+#---Functions for MIDI export---
+def motif_positions(pattern, scale, key_sig_qual = "custom"):
+    """
+    Places each note of a pattern in a particular octave, as Lilypond's \\relative mode does
+    for the motif: the first note in the octave of middle C, then each note on the staff
+    position closest to the one before (no more than a fourth away). Staff positions count
+    letter names, with the notes spelled as in int_seq_to_letters, so in scales with more
+    or fewer than seven notes the closest note is not always the fewest scale steps away.
+    Parameters:
+    -pattern: pattern in diatonic scale degrees [list]
+    -scale: scale in integer notation [list]
+    -key_sig_qual: key quality from get_key, which sets the spelling [string]
+    Returns: scale index of each note, counting on past the octave (7 is the upper root
+    of a 7-note scale, -1 the leading note below) [list]
+    """
+    quality = key_sig_qual if key_sig_qual in KEY_SPELLINGS else "custom"
+    positions = []
+    staff = 0 # Letter steps above middle C
+    for shift in diatonic_interval_shifts(pattern):
+        degree = shift % len(scale)
+        step = "CDEFGAB".index(SPELLING_TABLE[(scale[degree], quality)][0][0])
+        if positions:
+            up = (step - staff) % 7
+            staff += up if up <= 3 else up - 7
+        else:
+            staff = step
+        positions.append(degree + len(scale) * (staff // 7))
+    return positions
 
 
-def ly_note_to_ly_text(note):
+def sequence_steps(scale_length, mode = None):
     """
-    Converts ly format to ly markup text format
-    Parameter: note in ly note format [string]
-    Returns: text in ly text format[string]
+    Works out how far \\modalTranspose moves the motif for each repetition in the sequence,
+    in scale steps. The sequence runs along the scale, or along the given mode of it,
+    whose notes are reached from c (the first note of the scale).
+    Parameters:
+    -scale_length: number of notes in the scale [int]
+    -mode: index of the mode (0 for the scale itself) [int]
+    Returns: steps for each repetition [list]
     """
-    note = note.capitalize() # Safeguard for LY input
-    if note.endswith("s"):
-        new_text = "\\concat{" + note.replace("s","") + "\\super\\sharp}"
-    elif note.endswith("f"):
-        new_text = "\\concat{" + note.replace("f","") + "\\super\\flat}"
-    else:
-        new_text = note
-    return new_text
+    c_index = (scale_length - mode) % scale_length if mode else 0
+    return [index - c_index for index in range(scale_length)]
 
 
-#---Functions for compiling Lilypond string---
-def ly_list_to_melody(rhythm_val, melody):
+def iter_book_notes(name_of_scale, pattern, settings):
     """
-    Converts list in LY notation to Lilypond (LY) melody notation string
+    Works out the notes of a whole book as MIDI note numbers, without Lilypond:
+    the motif of pattern_on_scale repeated along the scale (or each mode),
+    transposed through the keys of the circle of fifths, as in make_ly_script.
     Parameters:
-    -rhythm_val list with 4 elements at different indices (see comments for related function) [list]
-    -melody given in LY letter name notation (e.g., ['c', 'ef', 'fs']) [list]
-    Returns:
-    -melody as a string in Lilypond format, including rhythm headers [string]
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    Yields: section with keys key (integer notation), mode (number, or None) and notes
+    (MIDI note numbers) [dict]
     """
+    scale = ALLOWED_SCALES[name_of_scale]
+    positions = motif_positions(pattern, scale, get_key(name_of_scale))
+    modes = range(len(scale)) if settings["modes"] else [None]
 
-    # Initialize string
-    melody_string = ""
-
-    # Add octave and rhythm value notation to first pitch (plus tuplet header if appl.)
-    melody_string = (str(rhythm_val[2]) +
-                     melody_string.join(melody[0] + "'" + str(rhythm_val[0])))
-
-    # Add subsequent pitches (and tuplet header if appl.)
-    melody_string = melody_string + " " + " ".join(melody[1:]) + str(rhythm_val[3])
+    for key in ALLOWED_PROGRESSIONS["circle of fifths"]:
+        for mode in modes:
+            notes = []
+            for steps in sequence_steps(len(scale), mode):
+                for position in positions:
+                    octave, index = divmod(position + steps, len(scale))
+                    notes.append(MIDI_MIDDLE_C + key + scale[index] + 12 * octave)
+            yield {"key": key, "mode": None if mode is None else mode + 1, "notes": notes}
 
-    return melody_string
 
-
-def make_ly_script(scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual, name_of_scale, settings):
+def note_ticks(rhythm_val, ticks_per_quarter = MIDI_TICKS_PER_QUARTER):
     """
-    Converts melodic motif to a sequence over a given scale.
+    Works out the length of each note in MIDI ticks, including any tuplet.
     Parameters:
-    -scale: scale given in standard letter name notation e.g., ['C', 'Eb', 'F#'] [list]
-    -motif: melodic motif in standard letter name notation [list]
-    -rhythm_val: 4-parameter list with rhythm value information for motif [list]
-    -name_of_scale: the full name of the scale (e.g., "natural minor") [string]
-    -key_sig_qual: a string with the key signature quality (major, minor or custom) [string]
-    Output: writes changes to file test.ly
-    """
-
-    # Convert scale and motif to lilypond format (as lists)
-    motif_ly_list = lett_list_to_ly_list(motif_let_seq)
-    scale_ly_list = lett_list_to_ly_list(scale_let_seq)
-    ly_add_slur(motif_ly_list)
-
-    # Convert ly lists to melody strings
-    motif_lilyp_string = ly_list_to_melody(rhythm_val, motif_ly_list)
-    scale_lilyp_string = ly_list_to_melody(rhythm_val, scale_ly_list)
-
-    lilyp_header = '\\version "2.24.3" \n\n\\language "english"\n\n#(set-global-staff-size 20)'
-    lilyp_scale_pre = "diatonicScale = \\relative {"
-    lilyp_motif_pre = "motif = \\relative {"
-
-    # Generate main melodic sequence string in LY format
-    lilyp_staff_melody = ly_scale_to_sequence(scale_ly_list)
-
-    # Initialize staff string (for all melodic components)
-    lilyp_staff_body = ""
-
-    # Generating keys to transpose over
-    keys = lett_list_to_ly_list(int_seq_to_letters(ALLOWED_PROGRESSIONS["circle of fifths"],
-                           key_sig_qual))
-    from_pitch = 'c' 
-
-    # Transpose to all 12 keys
-    for key in keys:
-
-        # Checks whether to print modes
-        if settings["modes"]:
-
-            # Generate modes of scale
-            modes_ly_list = generate_modes(scale_ly_list)
-
-            # Repeating sequence across all modes of scale
-            for i, mode in enumerate(modes_ly_list):
-                # Generate melody string
-                mode_lilyp_string = ly_list_to_melody(rhythm_val, mode)
-                lilyp_mode_melody = ly_scale_to_sequence(mode)
-
-                # Add text, key sig, and melody to body string
-                lilyp_staff_body += ("\\markup {" + str(ly_note_to_ly_text(key)) + " " +
-                                     str(name_of_scale) + "}\n" +
-                                     "\\markup \\italic {" + "Mode " + str(i + 1) + "}\n" +
-                                     lilyp_scale_pre + mode_lilyp_string + "}" +
-                                     "\n\\new Staff{\n\\key " + str(key) +
-                                     " \\" + str(key_sig_qual) +
-                                     "\n\\transpose " + str(from_pitch) + " " + str(key) + " {\n" +
-                                     lilyp_mode_melody + "}\n")
-
-            lilyp_staff_body += "\\pageBreak\n\n" # Page break between keys
-
-        # If modes is not True, just prints in all keys
-        else:
-            lilyp_staff_body += ("\\markup {" + ly_note_to_ly_text(key) + " " +
-                                 str(name_of_scale) + "}\n" +
-                                 lilyp_scale_pre + scale_lilyp_string + "}" +
-                                "\n\\new Staff{\n\\key " + str(key) + " \\" + str(key_sig_qual) +
-                                "\n\\transpose " + str(from_pitch) + " " + str(key) + " {\n" +
-                                lilyp_staff_melody + "}")
+    -rhythm_val: 4-parameter list from determine_rhyth_val [list]
+    -ticks_per_quarter: MIDI ticks in a quarter note [int]
+    Returns: ticks per note [int]
+    """
+    ticks = ticks_per_quarter * 4 // rhythm_val[0]
+    if rhythm_val[2]:
+        # e.g. "\\tuplet 3/2 { ": 3 notes in the time of 2
+        notes, time_of = rhythm_val[2].split()[1].split("/")
+        ticks = ticks * int(time_of) // int(notes)
+    return ticks
 
-    # Compiles final string with all elements
-    lilyp_full_text = "\n".join([lilyp_header,
-                                 lilyp_motif_pre, motif_lilyp_string, "}",
-                                 lilyp_staff_body])
 
-    return lilyp_full_text
+def midi_variable_length(value):
+    """
+    Encodes a number as a MIDI variable-length quantity.
+    Returns: encoded number [bytes]
+    """
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(data)
 
 
-#---Functions to produce PDF---
-def write_to_ly_file(lilypond_script, filename = 'test.ly'):
+def make_midi(name_of_scale, pattern, settings, tempo = 120, velocity = 80):
     """
-    Writes text to file in the directory. 
-    Defaults to filename test.ly
+    Writes a whole book as a Standard MIDI File (format 0), without engraving it.
+    Each key (and mode) starts with a marker naming it, after a quarter-note rest.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -tempo: quarter notes per minute [int]
+    -velocity: loudness of the notes, 1-127 [int]
+    Returns: contents of the .mid file [bytes]
     """
-    try:
-        f = open(filename, "w", encoding="utf-8")
-        try:
-            f.write(lilypond_script)
-            f.close()
-            print("Successfully written to " + filename + ".\n")
-        except (IOError, OSError):
-            print ("Error writing to " + filename + ".")
-    except (FileNotFoundError, NameError, PermissionError, OSError):
-        return "Error opening " + filename + "."
+    key_sig_qual = get_key(name_of_scale)
+    ticks = note_ticks(determine_rhyth_val(pattern))
+    title = (name_of_scale.capitalize() + " " + "-".join(str(degree) for degree in pattern)).encode()
+
+    track = bytearray()
+    track += b"\x00\xff\x51\x03" + (60000000 // tempo).to_bytes(3, "big") # Tempo
+    track += b"\x00\xff\x58\x04\x04\x02\x18\x08" # 4/4 time
+    track += b"\x00\xff\x03" + midi_variable_length(len(title)) + title # Track name
+
+    for section in iter_book_notes(name_of_scale, pattern, settings):
+        marker = SPELLING_TABLE[(section["key"], key_sig_qual if key_sig_qual in KEY_SPELLINGS
+                                 else "custom")][0] + " " + name_of_scale
+        if section["mode"] is not None:
+            marker += ", mode " + str(section["mode"])
+        marker = marker.encode()
+        track += (midi_variable_length(MIDI_TICKS_PER_QUARTER) + b"\xff\x06" +
+                  midi_variable_length(len(marker)) + marker)
+        for note in section["notes"]:
+            track += b"\x00" + bytes((0x90, note, velocity)) # Note on
+            track += midi_variable_length(ticks) + bytes((0x80, note, 0)) # Note off
+
+    track += b"\x00\xff\x2f\x00" # End of track
+    return (b"MThd" + struct.pack(">IHHH", 6, 0, 1, MIDI_TICKS_PER_QUARTER) +
+            b"MTrk" + struct.pack(">I", len(track)) + bytes(track))
+
+
+#---Functions for MusicXML export---
+def key_fifths(key, key_sig_qual):
+    """
+    Works out the key signature of a key, spelled as in int_seq_to_letters.
+    Parameters:
+    -key: key in integer notation [int]
+    -key_sig_qual: key quality from get_key [string]
+    Returns: sharps (positive) or flats (negative) in the key signature,
+    0 for custom scales, which are written without one [int]
+    """
+    if key_sig_qual not in ("major", "minor"):
+        return 0
+    letter = SPELLING_TABLE[(key, key_sig_qual)][0]
+    fifths = LETTER_FIFTHS[letter[0]] + 7 * (letter.count("#") - letter.count("b"))
+    return fifths - 3 if key_sig_qual == "minor" else fifths
 
 
-def run_lilypond(filename = 'test.ly'):
+def musicxml_pitch(note, key_sig_qual):
     """
-    Opens Lilypond with a shell command. 
-    Lilypond is required, and needs to be placed in the same directory as the main program.
-    It can be downloaded here (https://lilypond.org/doc/v2.25/Documentation/web/index)
-
+    Writes a MIDI note number as a MusicXML <pitch>, spelled as in int_seq_to_letters.
+    Returns: MusicXML element [string]
     """
-    subprocess.run(["lilypond-2.24.3/bin/lilypond " + filename], shell=True, check=False)
+    letter = SPELLING_TABLE[(note % 12, key_sig_qual if key_sig_qual in KEY_SPELLINGS
+                             else "custom")][0]
+    alter = letter.count("#") - letter.count("b")
+    return ("<pitch><step>" + letter[0] + "</step>" +
+            ("<alter>" + str(alter) + "</alter>" if alter else "") +
+            "<octave>" + str(note // 12 - 1) + "</octave></pitch>")
 
-#---Main function---
-def main():
+
+def xml_text(text):
     """
-    Main function.
-    Includes default parameters at the top for testing.
+    Escapes text for use in XML content.
+    Returns: escaped text [string]
     """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
-    # Default parameters for testing
-    # scale = ALLOWED_SCALES["major"]
-    # pattern = [1, 2, 4, 5]
-    # rhythm_val = [8, 4, "", ""]
-
-    # User input
-    welcome_message()
-    scale, name_of_scale, pattern, settings = basic_input()
-    wait_to_proceed()
 
-    # Generating basic sequence and related details
-    rhythm_val = determine_rhyth_val(pattern)
+def make_musicxml(name_of_scale, pattern, settings):
+    """
+    Writes a whole book as a MusicXML score, without engraving it, so it can be opened
+    in other notation programs. Each key (and mode) starts a new measure, with its key
+    signature and a heading naming it; the last measure of each is filled with rests.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    Returns: contents of the .musicxml file [bytes]
+    """
     key_sig_qual = get_key(name_of_scale)
-    motif_int_seq = pattern_on_scale(scale, pattern)
-
-    # Converting relevant melodies in integer notation to letter names
-    motif_let_seq = int_seq_to_letters(motif_int_seq, key_sig_qual)
-    scale_let_seq = int_seq_to_letters(scale, key_sig_qual)
-
-    # Generating Lilypond script in test.ly
-
-    lilypond_script = make_ly_script(scale_let_seq, motif_let_seq, rhythm_val,
-                                     key_sig_qual, name_of_scale, settings)
-    write_to_ly_file(lilypond_script)
-
-    # Launching Lilypond and generating PDF as test.pdf
-    run_lilypond()
+    rhythm_val = determine_rhyth_val(pattern)
+    duration = note_ticks(rhythm_val)
+    notes_per_measure = 4 * MIDI_TICKS_PER_QUARTER // duration
+    note_type = "<type>" + MUSICXML_NOTE_TYPES[rhythm_val[0]] + "</type>"
+    tuplet_notes = int(rhythm_val[2].split()[1].split("/")[0]) if rhythm_val[2] else 0
+    if tuplet_notes:
+        note_type += ("<time-modification><actual-notes>" + str(tuplet_notes) +
+                      "</actual-notes><normal-notes>" + rhythm_val[2].split()[1].split("/")[1] +
+                      "</normal-notes></time-modification>")
+    title = name_of_scale.capitalize() + " " + "-".join(str(degree) for degree in pattern)
+
+    parts = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+             '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+             '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+             '<score-partwise version="4.0">\n'
+             "<work><work-title>" + xml_text(title) + "</work-title></work>\n"
+             '<part-list><score-part id="P1"><part-name>' + xml_text(name_of_scale.capitalize()) +
+             "</part-name></score-part></part-list>\n"
+             '<part id="P1">\n']
+    measure_number = 0
+    for section in iter_book_notes(name_of_scale, pattern, settings):
+        heading = SPELLING_TABLE[(section["key"], key_sig_qual if key_sig_qual in KEY_SPELLINGS
+                                  else "custom")][0] + " " + name_of_scale
+        if section["mode"] is not None:
+            heading += ", mode " + str(section["mode"])
+        notes = section["notes"]
+        notes = notes + [None] * (-len(notes) % notes_per_measure) # Rests to fill the last measure
+
+        for index, note in enumerate(notes):
+            if index % notes_per_measure == 0:
+                measure_number += 1
+                parts.append('<measure number="' + str(measure_number) + '">')
+                if index == 0:
+                    parts.append("<attributes>" +
+                                 ("<divisions>" + str(MIDI_TICKS_PER_QUARTER) + "</divisions>"
+                                  if measure_number == 1 else "") +
+                                 "<key><fifths>" + str(key_fifths(section["key"], key_sig_qual)) +
+                                 "</fifths>" + ("<mode>" + key_sig_qual + "</mode>"
+                                                if key_sig_qual in ("major", "minor") else "") +
+                                 "</key>" +
+                                 ("<time><beats>4</beats><beat-type>4</beat-type></time>"
+                                  "<clef><sign>G</sign><line>2</line></clef>"
+                                  if measure_number == 1 else "") + "</attributes>")
+                    parts.append('<direction placement="above"><direction-type><words>' +
+                                 xml_text(heading) + "</words></direction-type></direction>")
+            tuplet = ""
+            if tuplet_notes and index % tuplet_notes == 0:
+                tuplet = '<notations><tuplet type="start"/></notations>'
+            elif tuplet_notes and index % tuplet_notes == tuplet_notes - 1:
+                tuplet = '<notations><tuplet type="stop"/></notations>'
+            parts.append("<note>" + ("<rest/>" if note is None else
+                                     musicxml_pitch(note, key_sig_qual)) +
+                         "<duration>" + str(duration) + "</duration>" + note_type + tuplet +
+                         "</note>")
+            if index % notes_per_measure == notes_per_measure - 1:
+                parts.append("</measure>\n")
+
+    parts.append("</part>\n</score-partwise>\n")
+    return "".join(parts).encode("utf-8")
+
+
+#---Job naming---
+def job_name(name_of_scale, pattern, settings):
+    """
+    Builds a file-friendly name for a job, e.g. "natural-minor_1-2-3-5_modes".
+    Returns: job name [string]
+    """
+    name = name_of_scale.replace(" ", "-") + "_" + "-".join(str(degree) for degree in pattern)
+    if settings["modes"]:
+        name += "_modes"
+    return name
+
+
+# Modules holding the rest of the program, searched in order by __getattr__
+LAZY_MODULES = ("sequencer_lilypond", "sequencer_tracing", "sequencer_compile", "sequencer_cli")
+
+
+def __getattr__(name):
+    """
+    Finds names that are not in the core (e.g. make_ly_script or run_lilypond)
+    in the other modules of the program, importing them on first use.
+    Settings such as LILYPOND_PATH should be changed in the module that defines them.
+    """
+    if not name.startswith("__"):
+        for module_name in LAZY_MODULES:
+            module = importlib.import_module(module_name)
+            if hasattr(module, name):
+                return getattr(module, name)
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
 
 
 if __name__ == '__main__':
-    main()
+    import sequencer_cli
+    sys.exit(sequencer_cli.cli_main(sys.argv[1:]))
@@ -0,0 +1,800 @@
+"""
+File: sequencer_cli.py
+---
+The command line of the musical pattern sequencer: the interactive prompts,
+batch mode and chord progressions.
+
+Usage: python sequencer_cli.py [batch options], or with no options for the prompts
+"""
+import argparse
+import csv
+import functools
+import json
+import os
+import re
+import sys
+import time
+
+import sequencer_compile
+from musicalpatternsequencer import (
+    ALLOWED_SCALES, DEFAULT_SETTINGS, check_pattern_valid, check_scale_valid, iter_pattern_space,
+    job_name, make_midi, make_musicxml, register_scale, try_int)
+from sequencer_tracing import MetricsCollector, add_hook, emit_event, remove_hook, trace_stage
+from sequencer_lilypond import generate_ly_fragments, make_progression_script
+from sequencer_compile import (
+    CACHE_DIR, CACHE_MAX_BYTES, ENGRAVED_FORMATS, FORMAT_EXTENSIONS, OUTPUT_ROOT, CircuitBreaker,
+    atomic_copy, atomic_write,
+    build_incremental, build_volumes, cache_clear, cache_entries, cache_evict, cache_key,
+    cache_lookup, cache_store, compile_in_background, compile_ly_files, job_paths, run_lilypond,
+    run_preview, write_to_ly_file)
+
+
+# ---User input-related functions---
+def welcome_message():
+    """
+    Displays an opening message.
+    """
+    welcome_text = """
+    ---------------------
+    - MUSICAL SEQUENCER -
+    ---------------------
+    This program repeats a pattern of scale degrees (e.g., 1-2-3-5) starting on each note of a scale.
+    This will be transposed through all twelve keys around the circle of fifths.
+    """
+    print(welcome_text)
+
+
+def basic_input():
+    """
+    User inputs core elements (scale and pattern) to be sequenced 
+    and returns these to the main function
+    Returns:
+    -user_scale: scale in letter format [list]
+    -user_scale_name: name of scale [string]
+    -user_pattern: scale degree pattern [list]
+    -settings: advanced settings [dict]
+    """
+    user_scale, user_scale_name = input_scale()
+    user_pattern = input_pattern(user_scale)
+    settings = advanced_settings()
+
+    print(user_scale_name.capitalize(), "scale:", user_scale)
+    print("Pattern:", user_pattern)
+    return user_scale, user_scale_name, user_pattern, settings
+
+
+def input_scale():
+    """
+    User inputs a scale
+    Checks for valid inputs
+    Returns:
+    -user_scale as integer notation [list]
+    -user_scale_string [string]
+    """
+    unkn_scale = "Hmm, I don't know that scale. "
+    init_options = "Enter 'major', 'minor' or 'custom': "
+    min_options = "Enter 'natural minor', 'melodic minor', or 'harmonic minor': "
+
+    init_valid_inputs = list(ALLOWED_SCALES) + ["custom"]
+    min_valid_inputs = ["natural minor", "melodic minor", "harmonic minor"]
+    print("First, let's select a scale.")
+
+    # Checks for valid inputs
+    user_scale_string = check_input_valid("What type of scale would you like to use? " +
+                      init_options, init_valid_inputs, unkn_scale)
+
+    # Specifies type of minor scale and checks for valid inputs
+    if user_scale_string == 'minor':
+        user_scale_string = check_input_valid("Which type of minor? " + min_options,
+                                              min_valid_inputs, unkn_scale)
+    elif user_scale_string == 'custom':
+        user_scale_string = input_custom_scale()
+
+    # Determine scale setup from allowable list
+    user_scale = ALLOWED_SCALES[user_scale_string]
+    print("\nOK, a " + str(user_scale_string) + " scale (" + str(user_scale) + ").\n")
+    return user_scale, user_scale_string
+
+
+def input_custom_scale():
+    """
+    User enters their own scale, which is added to the scale registry (see register_scale).
+    Returns: name of the new scale [string]
+    """
+    input_message = ("Enter the notes of your scale in semitones above the root "
+                     "(e.g., 0 2 4 5 7 9 10 11 for bebop dominant): ")
+    user_scale = [try_int(item) for item in input(input_message).split()]
+    error_message = check_scale_valid(user_scale)
+    while error_message:
+        print(error_message + " Try again.")
+        user_scale = [try_int(item) for item in input(input_message).split()]
+        error_message = check_scale_valid(user_scale)
+
+    name = input("What would you like to call it? ").strip().lower() or "custom"
+    while name in ALLOWED_SCALES and ALLOWED_SCALES[name] != user_scale:
+        name = input("There is already a scale called " + name + ". Choose another name: ")
+        name = name.strip().lower() or "custom"
+    return register_scale(name, user_scale)["name"]
+
+
+def input_pattern(scale):
+    """
+    User enters a pattern and checks validity of entry
+    Parameter: scale as integer notation [list]
+    Returns: pattern as integer notation [list]
+    """
+    input_message = "Enter a series of scale degrees (e.g., 1 2 3 5) with spaces in-between: "
+    print("Next, let's set up a pattern to be repeated across the scale.")
+    print("Note that your scale has " + str(len(scale)) + " scale degrees.")
+    user_input_pattern = []
+
+    # Verify user input for 4 cases: no entry, non-int, negative int, and # greater than # in scale
+    user_input_pattern = [try_int(item) for item in input(input_message).split()]
+    print(user_input_pattern)
+    error_message = check_pattern_valid(user_input_pattern, scale)
+    while error_message:
+        print(error_message + " Try again.")
+        user_input_pattern = [try_int(item) for item in input(input_message).split()]
+        error_message = check_pattern_valid(user_input_pattern, scale)
+
+    # Display pattern back to user
+    print("\nOK, your pattern is " + str(user_input_pattern) + ".\n")
+    return user_input_pattern
+
+
+def advanced_settings():
+    """
+    User inputs advanced settings.
+    Returns settings [dict]
+    """
+    valid_inputs = ["y", "n"]
+
+    # Sets default settings
+    settings = dict(DEFAULT_SETTINGS)
+    enter_settings = check_input_valid("Enter advanced settings (y/n)? ", valid_inputs)
+    if enter_settings == "n":
+        return settings
+    else:
+        print("\n" + "---Advanced settings---" + "\n"
+            )
+
+        settings["modes"] = check_input_valid("Generate all modes of scale (y/n)? ", valid_inputs)
+
+        # Convert to bools
+        for option in settings:
+            if settings[option] == "y":
+                settings[option] = True
+            else:
+                settings[option] = False
+
+        print("---") # Section separator for clarity
+        return settings
+
+
+def check_input_valid(prompt, valid_values, error_message = "Invalid input. Try again." + "\n"):
+    """
+    Checks if user input is within 
+    Note that this does not display specific error messages,
+    so it is best used for generic cases.
+    Parameters:
+    -prompt: display message to prompt input [string]
+    -valid_values: valid entries [list]
+    """
+    entry = input(prompt).strip().lower()
+    while entry not in valid_values:
+        print(error_message)
+        entry = input(prompt).strip().lower()
+    return entry
+
+
+def wait_to_proceed():
+    """
+    Prompts the user to continue.
+    Used to pause program before generating more messages.
+    """
+    print("Press enter to continue.")
+    input("")
+    print("") # Line break to aid console readability
+
+
+#---Functions for batch mode---
+def read_scales(filename):
+    """
+    Reads custom scales from a CSV, JSON or YAML file and registers them (see register_scale),
+    so manifests and catalogues can use them by name.
+    CSV files have the columns name and notes (in semitones above the root,
+    e.g. "0 2 4 5 7 9 10 11"), plus an optional key column for the key signature quality
+    (major, minor or custom). JSON and YAML files hold a list of objects with the same keys.
+    Parameter: filename of the scales [string]
+    Returns: names of the scales [list]
+    """
+    names = []
+    for row in read_rows(filename):
+        notes = row["notes"]
+        if isinstance(notes, str):
+            notes = notes.replace(",", " ").split()
+        try:
+            info = register_scale(str(row["name"]), [try_int(note) for note in notes],
+                                  row.get("key") or None)
+        except ValueError as error:
+            raise ValueError(str(row["name"]) + ": " + str(error)) from None
+        names.append(info["name"])
+    return names
+
+
+def read_rows(filename):
+    """
+    Reads a list of rows from a CSV, JSON or YAML file.
+    YAML needs the PyYAML package to be installed.
+    Parameter: filename [string]
+    Returns: rows, with text values for CSV files [list of dicts]
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    with open(filename, newline="", encoding="utf-8") as f:
+        if extension == ".csv":
+            return list(csv.DictReader(f))
+        elif extension == ".json":
+            return json.load(f)
+        elif extension in (".yaml", ".yml"):
+            import yaml # Optional dependency, only needed for YAML files
+            return yaml.safe_load(f)
+        raise ValueError("Unknown file format: " + filename)
+
+
+def read_manifest(filename):
+    """
+    Reads a batch manifest of jobs from a CSV, JSON or YAML file.
+    CSV manifests have the columns scale, pattern (e.g., "1 2 3 5") and modes (y/n),
+    plus optional name and formats (e.g., "pdf svg musicxml") columns. JSON and YAML
+    manifests hold a list of objects with the keys scale, pattern, settings and
+    (optionally) name and formats.
+    YAML needs the PyYAML package to be installed.
+    Parameter: filename of the manifest [string]
+    Returns: jobs, each with keys name, scale, pattern, settings and formats; rows that
+    cannot be read become jobs with an error key, which run_batch records [list of dicts]
+    """
+    rows = read_rows(filename)
+    if os.path.splitext(filename)[1].lower() == ".csv":
+        for row in rows:
+            row["settings"] = {"modes": row.pop("modes", None)}
+
+    jobs = []
+    for number, row in enumerate(rows, 1):
+        # A bad row becomes a failed job, so it does not stop the rest of the batch
+        try:
+            jobs.append(manifest_row_to_job(row))
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            name = row.get("name") if isinstance(row, dict) else None
+            jobs.append({"name": str(name or "row-" + str(number)), "scale": "", "pattern": [],
+                         "settings": dict(DEFAULT_SETTINGS), "formats": None,
+                         "error": "Row " + str(number) + ": " + describe_row_error(error)})
+    return jobs
+
+
+def describe_row_error(error):
+    """
+    Describes why a manifest row could not be read.
+    Parameter: error raised by manifest_row_to_job [Exception]
+    Returns: error message [string]
+    """
+    if isinstance(error, KeyError):
+        return "missing " + str(error.args[0]) + "."
+    return str(error)
+
+
+def read_flag(value):
+    """
+    Reads a yes/no value of a manifest, e.g. "y", "no", "true" or 1.
+    Parameter: value, None or empty when not given [any]
+    Returns: the flag [bool]
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ("y", "yes", "true", "1")
+    return bool(value)
+
+
+def manifest_row_to_job(row):
+    """
+    Normalizes a row of a manifest into a job.
+    Raises KeyError if the row has no scale or pattern.
+    Parameter: row with keys scale, pattern and optionally settings, name and formats [dict]
+    Returns: job with keys name, scale, pattern, settings and formats (None if the row
+    gives none) [dict]
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Each row must have a scale and a pattern.")
+    pattern = row["pattern"]
+    if pattern is None:
+        raise KeyError("pattern")
+    if not isinstance(pattern, (list, tuple)):
+        pattern = str(pattern).replace(",", " ").split()
+    pattern = [try_int(item) for item in pattern]
+
+    settings = dict(DEFAULT_SETTINGS)
+    if not isinstance(row.get("settings") or {}, dict):
+        raise ValueError("settings must map options to y/n, e.g. {\"modes\": \"y\"}.")
+    settings.update(row.get("settings") or {})
+    settings = {option: read_flag(value) for option, value in settings.items()}
+
+    if row["scale"] is None:
+        raise KeyError("scale")
+    scale_name = str(row["scale"]).strip().lower()
+    formats = row.get("formats") or None
+    if isinstance(formats, str):
+        formats = formats.replace(",", " ").lower().split() or None
+    elif formats is not None and not isinstance(formats, (list, tuple)):
+        raise ValueError("formats must be a list, e.g. \"pdf svg\".")
+
+    name = row.get("name") or job_name(scale_name, pattern, settings)
+    return {"name": str(name), "scale": scale_name, "pattern": pattern, "settings": settings,
+            "formats": formats}
+
+
+def catalogue_jobs(scale_names, max_length, settings = None, **filters):
+    """
+    Yields a batch job for every pattern of up to max_length notes over each scale,
+    e.g. to render every pattern up to length 6 over every scale in ALLOWED_SCALES.
+    Takes the same filters as iter_patterns; dedupe defaults to True.
+    Parameters:
+    -scale_names: names of the scales to use [list]
+    -max_length: longest pattern to include [int]
+    -settings: advanced settings for every job, defaults to DEFAULT_SETTINGS [dict]
+    Yields: job with keys name, scale, pattern and settings [dict]
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    filters.setdefault("dedupe", True)
+    for name_of_scale in scale_names:
+        for pattern in iter_pattern_space(ALLOWED_SCALES[name_of_scale], max_length, **filters):
+            yield {"name": job_name(name_of_scale, pattern, settings), "scale": name_of_scale,
+                   "pattern": pattern, "settings": settings}
+
+
+def run_batch(jobs, output_dir, compile_pdf = False, workers = None, timeout = None,
+              cache_dir = None, cache_max_bytes = CACHE_MAX_BYTES, stream = False, batch_size = 1,
+              incremental = False, midi = False, keys_per_volume = None, page_budget = None,
+              formats = ()):
+    """
+    Generates a Lilypond file for each job without any user input.
+    Invalid jobs are recorded as errors and do not stop the batch.
+    Parameters:
+    -jobs: jobs as returned by read_manifest [list of dicts]
+    -output_dir: directory to write the .ly files to [string]
+    -compile_pdf: whether to compile the generated files with Lilypond [bool]
+    -workers: number of Lilypond processes to run at once [int]
+    -timeout: seconds to allow each Lilypond run [float]
+    -cache_dir: cache of earlier results to reuse and update, None to disable caching [string]
+    -cache_max_bytes: size the cache is trimmed to after the batch [int]
+    -stream: pipe the scripts straight into Lilypond instead of writing .ly files;
+    only used for jobs that are compiled [bool]
+    -batch_size: documents to compile per Lilypond run [int]
+    -incremental: compile books from per-key fragments, reusing unchanged fragments
+    (see build_incremental) [bool]
+    -midi: also write a MIDI file for each job, straight from the notes (see make_midi) [bool]
+    -keys_per_volume: compile each book as volumes of this many keys at once, then merge
+    them (see build_volumes) [int]
+    -page_budget: compile each book as volumes of about this many pages [float]
+    -formats: further output formats for each job, keys of FORMAT_EXTENSIONS, e.g.
+    ("svg", "musicxml"); jobs that list their own formats use those instead. All the
+    engraved formats of a job come from one Lilypond run [tuple]
+    Returns: one result per job with status, output file and timing [list of dicts]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    sources = {} # Functions generating the scripts to stream to Lilypond, by job name
+    used_names = set()
+
+    for job in jobs:
+        # Repeated names get a suffix, so every job has its own output files
+        name = job["name"]
+        copy_number = 1
+        while name in used_names:
+            copy_number += 1
+            name = job["name"] + "-" + str(copy_number)
+        used_names.add(name)
+
+        result = {"name": name, "scale": job["scale"], "pattern": job["pattern"],
+                  "settings": job["settings"], "status": "ok", "error": None, "output": None,
+                  "pdf": None, "midi": None, "musicxml": None, "cached": False}
+        start = time.perf_counter()
+
+        job_formats = set(job.get("formats") or formats)
+        if compile_pdf:
+            job_formats.add("pdf")
+        if midi:
+            job_formats.add("midi")
+        engraved = [output_format for output_format in ENGRAVED_FORMATS
+                    if output_format in job_formats]
+        result["formats"] = sorted(job_formats | {"ly"})
+        job_stream = stream and bool(engraved)
+
+        if job.get("error"):
+            result["error"] = job["error"]
+        elif job["scale"] not in ALLOWED_SCALES:
+            result["error"] = "Unknown scale: " + job["scale"]
+        elif job_formats - set(FORMAT_EXTENSIONS):
+            result["error"] = "Unknown output format: " + ", ".join(
+                sorted(job_formats - set(FORMAT_EXTENSIONS)))
+        elif (incremental or keys_per_volume or page_budget) and engraved not in ([], ["pdf"]):
+            result["error"] = "Incremental and volume builds only make PDFs."
+        else:
+            result["error"] = check_pattern_valid(job["pattern"], ALLOWED_SCALES[job["scale"]])
+
+        if result["error"] is None:
+            try:
+                paths = job_paths(name, output_dir)
+                entry_dir = None
+                if cache_dir:
+                    result["cache_key"] = cache_key(job["scale"], job["pattern"], job["settings"])
+                    entry_dir = cache_lookup(result["cache_key"], cache_dir)
+
+                if cache_dir:
+                    emit_event("cache_hit" if entry_dir else "cache_miss")
+                if entry_dir:
+                    # Cache hit: copy the stored files instead of regenerating them
+                    cached_pdf = os.path.join(entry_dir, "score.pdf")
+                    if os.path.isfile(cached_pdf):
+                        atomic_copy(cached_pdf, paths["pdf"])
+                        result["pdf"] = paths["pdf"]
+                    result["cached"] = (engraved == ["pdf"] and result["pdf"] is not None or
+                                        not engraved)
+                    if job_stream:
+                        if not result["cached"]:
+                            sources[name] = functools.partial(
+                                generate_ly_fragments, job["scale"], job["pattern"], job["settings"])
+                    else:
+                        atomic_copy(os.path.join(entry_dir, "score.ly"), paths["ly"])
+                        result["output"] = paths["ly"]
+                else:
+                    if job_stream:
+                        # Generated when its compile starts, so scripts are never all held at once
+                        sources[name] = functools.partial(
+                            generate_ly_fragments, job["scale"], job["pattern"], job["settings"])
+                    else:
+                        with trace_stage("write_ly", file=paths["ly"]) as event:
+                            event["ly_chars"] = atomic_write(paths["ly"], generate_ly_fragments(
+                                job["scale"], job["pattern"], job["settings"]))
+                        result["output"] = paths["ly"]
+                if "midi" in job_formats:
+                    with trace_stage("midi"):
+                        atomic_write(paths["midi"], make_midi(job["scale"], job["pattern"],
+                                                              job["settings"]))
+                    result["midi"] = paths["midi"]
+                if "musicxml" in job_formats:
+                    with trace_stage("musicxml"):
+                        atomic_write(paths["musicxml"], make_musicxml(job["scale"], job["pattern"],
+                                                                      job["settings"]))
+                    result["musicxml"] = paths["musicxml"]
+            except (KeyError, ValueError, OSError) as error:
+                result["error"] = str(error)
+
+        if result["error"] is not None:
+            result["status"] = "error"
+        result["elapsed"] = time.perf_counter() - start
+        results.append(result)
+
+    if incremental:
+        for result in results:
+            if result["status"] == "ok" and not result["cached"] and "pdf" in result["formats"]:
+                build = build_incremental(result["scale"], result["pattern"], result["settings"],
+                                          job_paths(result["name"], output_dir)["pdf"],
+                                          workers=workers, timeout=timeout)
+                result["compile"] = {"status": build["status"], "compiled": build["compiled"],
+                                     "reused": build["reused"]}
+                if build["status"] == "ok":
+                    result["pdf"] = build["output"]
+                else:
+                    result["status"] = "error"
+                    result["error"] = build["error"]
+    elif keys_per_volume or page_budget:
+        breaker = CircuitBreaker()
+        for result in results:
+            if result["status"] == "ok" and not result["cached"] and "pdf" in result["formats"]:
+                build = build_volumes(result["scale"], result["pattern"], result["settings"],
+                                      job_paths(result["name"], output_dir)["pdf"],
+                                      keys_per_volume, page_budget, workers, timeout, breaker)
+                result["compile"] = {"status": build["status"], "volumes": build["volumes"]}
+                if build["status"] == "ok":
+                    result["pdf"] = build["output"]
+                else:
+                    result["status"] = "error"
+                    result["error"] = build["error"]
+    else:
+        # Jobs wanting the same engraved formats are compiled together
+        groups = {}
+        for result in results:
+            engraved = tuple(output_format for output_format in ENGRAVED_FORMATS
+                             if output_format in result["formats"])
+            if engraved and not result["cached"]:
+                groups.setdefault(engraved, []).append(result)
+        breaker = CircuitBreaker()
+        for engraved, group in groups.items():
+            compile_batch(group, output_dir, workers, timeout, sources if stream else None,
+                          batch_size, breaker, engraved)
+
+    for result in results:
+        emit_event("job", status=result["status"], error=result["error"],
+                   duration=result["elapsed"], cached=result["cached"])
+
+    if cache_dir:
+        for result in results:
+            if result["status"] == "ok" and not result["cached"]:
+                if result["name"] in sources:
+                    lilypond_script = "".join(sources[result["name"]]())
+                else:
+                    with open(result["output"], encoding="utf-8") as f:
+                        lilypond_script = f.read()
+                cache_store(result["cache_key"], lilypond_script, result["pdf"], cache_dir)
+        cache_evict(cache_max_bytes, cache_dir)
+
+    return results
+
+
+def compile_batch(results, output_dir, workers = None, timeout = None, sources = None,
+                  batch_size = 1, breaker = None, formats = None):
+    """
+    Compiles the successfully generated jobs of a batch in parallel,
+    adding the Lilypond result of each to its job result.
+    Parameters:
+    -results: job results from run_batch [list of dicts]
+    -output_dir: directory of the batch output [string]
+    -workers: number of Lilypond processes to run at once [int]
+    -timeout: seconds to allow each Lilypond run [float]
+    -sources: scripts to stream to Lilypond, or functions generating them, by job name;
+    None to compile the .ly files [dict]
+    -batch_size: documents to compile per Lilypond run [int]
+    -breaker: circuit breaker that backs off, and eventually skips the remaining jobs,
+    while Lilypond keeps failing; defaults to a new CircuitBreaker [CircuitBreaker]
+    -formats: formats to engrave, None for just a PDF (see run_lilypond) [tuple]
+    """
+    generated = [result for result in results if result["status"] == "ok"]
+    filenames = [job_paths(result["name"], output_dir)["ly"] for result in generated]
+    compile_results = compile_ly_files(
+        filenames, workers, timeout,
+        sources=[sources[result["name"]] for result in generated] if sources else None,
+        batch_size=batch_size, breaker=breaker or CircuitBreaker(), formats=formats)
+
+    for result, compile_result in zip(generated, compile_results):
+        result["compile"] = compile_result
+        result["elapsed"] += compile_result["elapsed"]
+        if compile_result["status"] == "ok":
+            if formats is None or "pdf" in formats:
+                result["pdf"] = job_paths(result["name"], output_dir)["pdf"]
+        else:
+            result["status"] = "error"
+            error = compile_result["error"]
+            result["error"] = ("Lilypond " + error["type"].replace("_", " ") +
+                               (": " + error["message"] if error["message"] else ""))
+
+
+def write_batch_results(results, filename):
+    """
+    Writes batch results to a JSON file.
+    """
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def batch_main(argv):
+    """
+    Entry point for batch mode.
+    Parameter: command line arguments, without the program name [list]
+    """
+    parser = argparse.ArgumentParser(description="Render a manifest of scale/pattern jobs.")
+    parser.add_argument("--manifest", help="CSV, JSON or YAML list of jobs")
+    parser.add_argument("--catalogue", type=int, metavar="MAX_LENGTH",
+                        help="instead of a manifest, render every pattern up to MAX_LENGTH notes "
+                             "over every scale (one pattern per set of diatonic shifts, "
+                             "see --no-dedupe)")
+    parser.add_argument("--modes", action="store_true", help="with --catalogue, include modes")
+    parser.add_argument("--no-dedupe", action="store_true",
+                        help="with --catalogue, also include patterns that are diatonic shifts "
+                             "of one another (e.g. 2 3 4 as well as 1 2 3)")
+    parser.add_argument("--scales",
+                        help="CSV, JSON or YAML list of custom scales (name, notes and "
+                             "optionally key) to add before reading the jobs")
+    parser.add_argument("--progression",
+                        help="instead of a manifest, play --pattern over a chord progression: "
+                             "a name from ALLOWED_PROGRESSIONS or chords, e.g. \"Dm7 G7 Cmaj7\"")
+    parser.add_argument("--pattern", help="with --progression, the pattern, e.g. \"1 2 3 5\"")
+    parser.add_argument("--output-dir", default=OUTPUT_ROOT, help="directory for generated files")
+    parser.add_argument("--results", default=None,
+                        help="where to write the JSON results (default: OUTPUT_DIR/results.json)")
+    parser.add_argument("--compile", action="store_true", help="compile PDFs with Lilypond")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Lilypond processes to run at once (default: number of cores)")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds to allow each Lilypond run")
+    parser.add_argument("--memory-limit-mb", type=float,
+                        default=sequencer_compile.LILYPOND_MEMORY_LIMIT / (1024 * 1024),
+                        help="memory allowed to each Lilypond process, 0 for no limit")
+    parser.add_argument("--cpu-limit", type=float, default=None,
+                        help="seconds of CPU time allowed to each Lilypond process")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="documents to compile per Lilypond run, to share its start-up time")
+    parser.add_argument("--incremental", action="store_true",
+                        help="with --compile, build each book from per-key fragments and only "
+                             "recompile the fragments that changed (needs Ghostscript)")
+    parser.add_argument("--keys-per-volume", type=int, default=None,
+                        help="with --compile, engrave each book as volumes of this many keys "
+                             "in parallel and merge them (needs Ghostscript)")
+    parser.add_argument("--page-budget", type=float, default=None,
+                        help="with --compile, engrave each book as volumes of about this many "
+                             "pages in parallel and merge them (needs Ghostscript)")
+    parser.add_argument("--stream", action="store_true",
+                        help="with --compile, pipe scripts into Lilypond without writing .ly files")
+    parser.add_argument("--midi", action="store_true",
+                        help="also write a MIDI file for each job (does not need Lilypond)")
+    parser.add_argument("--formats", default="",
+                        help="further output formats for each job, e.g. \"png,svg,musicxml\" "
+                             "(from " + ", ".join(FORMAT_EXTENSIONS) + "); the engraved ones "
+                             "come from one Lilypond run, and a manifest formats column "
+                             "overrides this")
+    parser.add_argument("--metrics", help="write per-stage metrics to this file "
+                                          "(Prometheus text format for .prom, otherwise JSON)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="cache of generated files")
+    parser.add_argument("--no-cache", action="store_true", help="regenerate every job")
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_BYTES / (1024 * 1024),
+                        help="size limit of the cache in megabytes")
+    parser.add_argument("--cache-info", action="store_true", help="list the cache and exit")
+    parser.add_argument("--cache-clear", action="store_true", help="empty the cache and exit")
+    args = parser.parse_args(argv)
+
+    if args.cache_info:
+        entries = cache_entries(args.cache_dir)
+        for entry in entries:
+            print(entry["key"], entry["size"], ",".join(entry["files"]),
+                  time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_used"])))
+        print(str(len(entries)) + " entries, " +
+              str(sum(entry["size"] for entry in entries)) + " bytes.")
+        return 0
+    if args.cache_clear:
+        cache_clear(args.cache_dir)
+        print("Cache cleared.")
+        return 0
+    # Set before any Lilypond run, progressions included
+    sequencer_compile.LILYPOND_MEMORY_LIMIT = int(args.memory_limit_mb * 1024 * 1024) or None
+    sequencer_compile.LILYPOND_CPU_LIMIT = args.cpu_limit
+    if args.scales:
+        try:
+            read_scales(args.scales)
+        except (KeyError, ValueError) as error:
+            parser.error("--scales: " + str(error))
+    if args.progression:
+        return progression_main(args)
+    if args.catalogue:
+        # "minor" is the same scale as "natural minor"
+        jobs = catalogue_jobs([name for name in ALLOWED_SCALES if name != "minor"],
+                              args.catalogue, {"modes": args.modes}, dedupe=not args.no_dedupe)
+    elif args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        parser.error("--manifest or --catalogue is required")
+
+    collector = MetricsCollector()
+    add_hook(collector)
+    start = time.perf_counter()
+    try:
+        results = run_batch(jobs, args.output_dir, args.compile, args.workers, args.timeout,
+                            None if args.no_cache else args.cache_dir,
+                            int(args.cache_max_mb * 1024 * 1024), args.stream,
+                            args.batch_size, args.incremental, args.midi,
+                            args.keys_per_volume, args.page_budget,
+                            tuple(args.formats.replace(",", " ").lower().split()))
+    finally:
+        remove_hook(collector)
+    elapsed = time.perf_counter() - start
+
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(collector.to_prometheus() if args.metrics.endswith(".prom")
+                    else collector.to_json())
+
+    results_file = args.results or os.path.join(args.output_dir, "results.json")
+    write_batch_results(results, results_file)
+
+    failed = sum(1 for result in results if result["status"] != "ok")
+    cached = sum(1 for result in results if result["cached"])
+    print(str(len(results) - failed) + " of " + str(len(results)) + " jobs succeeded (" +
+          str(cached) + " from cache) in " + format(elapsed, ".2f") + "s. Results written to " +
+          results_file + ".")
+    return 1 if failed else 0
+
+
+def progression_main(args):
+    """
+    Writes (and with --compile, engraves) a pattern played over a chord progression.
+    Parameter: parsed command line arguments of batch_main [argparse.Namespace]
+    """
+    pattern = [try_int(degree) for degree in (args.pattern or "").replace(",", " ").split()]
+    name = (re.sub(r"[^0-9A-Za-z]+", "-", args.progression).strip("-") + "_" +
+            "-".join(str(degree) for degree in pattern))
+    paths = job_paths(name, args.output_dir)
+    try:
+        lilypond_script = make_progression_script(args.progression, pattern)
+    except ValueError as error:
+        print(error)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_to_ly_file(lilypond_script, paths["ly"])
+    if args.compile:
+        result = run_lilypond(paths["ly"], args.timeout)
+        print_lilypond_result(result, paths["pdf"])
+        return 0 if result["status"] == "ok" else 1
+    return 0
+
+
+#---Main function---
+def main():
+    """
+    Main function.
+    Includes default parameters at the top for testing.
+    """
+
+    # Default parameters for testing
+    # scale = ALLOWED_SCALES["major"]
+    # pattern = [1, 2, 4, 5]
+    # rhythm_val = [8, 4, "", ""]
+
+    # User input
+    welcome_message()
+    scale, name_of_scale, pattern, settings = basic_input()
+    wait_to_proceed()
+
+    # Generating Lilypond script in its own file under the output folder
+    paths = job_paths(job_name(name_of_scale, pattern, settings))
+    os.makedirs(OUTPUT_ROOT, exist_ok=True)
+    write_to_ly_file(generate_ly_fragments(name_of_scale, pattern, settings), paths["ly"])
+
+    # Optionally previewing the first key before engraving the whole book
+    if check_input_valid("Preview the first key before generating the PDF (y/n)? ",
+                         ["y", "n"]) == "y":
+        result = run_preview(name_of_scale, pattern, settings, paths["preview"])
+        if result["output"] is None:
+            if result["status"] == "ok":
+                # Lilypond ran without errors but wrote no preview image
+                print("Lilypond ran, but no preview image was produced.\n" + result["stderr"])
+            else:
+                print("Lilypond " + result["status"] + ".\n" + result["stderr"])
+            return
+        print("Preview generated: " + paths["preview"])
+        if check_input_valid("Generate the full PDF (y/n)? ", ["y", "n"]) == "n":
+            return
+
+        # The PDF is reported when it is ready; the program exits once it has finished
+        print("Generating the full PDF in the background...")
+        future = compile_in_background(paths["ly"])
+        future.add_done_callback(lambda done: print_lilypond_result(done.result(), paths["pdf"]))
+        return
+
+    # Launching Lilypond and generating the PDF next to it
+    print_lilypond_result(run_lilypond(paths["ly"]), paths["pdf"])
+
+
+def print_lilypond_result(result, pdf_file):
+    """
+    Tells the user whether the PDF was generated.
+    Parameters:
+    -result: result from run_lilypond [dict]
+    -pdf_file: the PDF Lilypond was making [string]
+    """
+    if result["status"] == "ok":
+        print("PDF generated: " + pdf_file)
+    else:
+        print("Lilypond " + result["status"] + ".\n" + result["stderr"])
+
+
+def cli_main(argv):
+    """
+    Runs batch mode if there are command line arguments, otherwise the prompts.
+    Parameter: command line arguments, without the program name [list]
+    Returns: exit status [int]
+    """
+    if argv:
+        return batch_main(argv)
+    main()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli_main(sys.argv[1:]))
@@ -0,0 +1,1146 @@
+"""
+File: sequencer_compile.py
+---
+Runs Lilypond (and Ghostscript) on the scripts from sequencer_lilypond:
+writing files, compiling them in parallel under time and memory limits,
+incremental builds, long-running workers and the cache of generated files.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    import resource # Process limits, only available on Unix
+except ImportError:
+    resource = None
+
+from musicalpatternsequencer import (
+    ALLOWED_SCALES, DEFAULT_SETTINGS, LILYPOND_HEADER, LILYPOND_VERSION, LY_TO_LETTER, make_midi,
+    make_musicxml)
+from sequencer_tracing import emit_event, trace_stage
+from sequencer_lilypond import (
+    generate_ly_script, iter_ly_fragments, iter_ly_volumes, make_preview_script)
+
+LILYPOND_PATH = "lilypond-" + LILYPOND_VERSION + "/bin/lilypond"
+
+# Limits on each Lilypond process, so a pathological script cannot hang or
+# use up the machine; None turns a limit off. The memory and CPU limits are applied on Linux.
+LILYPOND_TIMEOUT = 600 # Wall-clock seconds, used when a run is given no timeout
+LILYPOND_MEMORY_LIMIT = 4 * 1024 * 1024 * 1024 # Bytes of address space (RLIMIT_AS)
+LILYPOND_CPU_LIMIT = None # Seconds of processor time (RLIMIT_CPU)
+
+# Messages Lilypond (or its Guile runtime) gives when it runs out of memory
+OUT_OF_MEMORY_MESSAGES = ("out of memory", "cannot allocate memory", "bad_alloc")
+
+# Statuses counted by a CircuitBreaker: signs that Lilypond itself is in trouble,
+# rather than a mistake in one script
+BREAKER_FAILURES = ("crashed", "timeout", "error")
+
+OUTPUT_ROOT = "output"
+
+# File extension of each output format. Lilypond engraves the first three;
+# the others are written straight from the notes (see render_formats)
+FORMAT_EXTENSIONS = {"pdf": ".pdf", "png": ".png", "svg": ".svg",
+                     "ly": ".ly", "midi": ".mid", "musicxml": ".musicxml"}
+ENGRAVED_FORMATS = ("pdf", "png", "svg")
+
+GHOSTSCRIPT_PATH = "gs"
+FRAGMENT_DIR = ".sequencer_fragments"
+
+PREVIEW_RESOLUTION = 72 # Dots per inch of preview images
+
+CACHE_DIR = ".sequencer_cache"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+#---Functions to produce PDF---
+def write_to_ly_file(lilypond_script, filename = 'test.ly'):
+    """
+    Writes text to file in the directory. 
+    Defaults to filename test.ly
+    The text can be a string or an iterable of fragments, e.g. from iter_ly_script.
+    The file is replaced in one step, so a compile running at the same time
+    never reads a half-written file.
+    """
+    try:
+        with trace_stage("write_ly", file=filename) as event:
+            event["ly_chars"] = atomic_write(filename, lilypond_script)
+        print("Successfully written to " + filename + ".\n")
+    except (FileNotFoundError, NameError, PermissionError, OSError):
+        return "Error opening " + filename + "."
+
+
+def atomic_write(filename, data):
+    """
+    Writes text or bytes to a temporary file next to filename, then renames it into place.
+    Parameters:
+    -filename: file to create or replace [string]
+    -data: contents of the file, or text fragments to write in order [string, bytes or iterable]
+    Returns: number of characters (or bytes) written [int]
+    """
+    directory = os.path.dirname(filename) or "."
+    handle, temp_name = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(filename),
+                                         suffix=".tmp")
+    try:
+        if isinstance(data, bytes):
+            with open(handle, "wb") as f:
+                written = f.write(data)
+        else:
+            with open(handle, "w", encoding="utf-8") as f:
+                written = write_ly_stream(data, f)
+        os.replace(temp_name, filename)
+        return written
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def write_ly_stream(fragments, stream):
+    """
+    Writes Lilypond text to an open text file or pipe, one fragment at a time.
+    Parameters:
+    -fragments: text to write, as a string or an iterable of strings [string or iterable]
+    -stream: open file object to write to [io.TextIOBase]
+    Returns: number of characters written [int]
+    """
+    if isinstance(fragments, str):
+        fragments = (fragments,)
+    written = 0
+    for fragment in fragments:
+        written += stream.write(fragment)
+    return written
+
+
+def atomic_copy(source, destination):
+    """
+    Copies a file so that the destination is replaced in one step.
+    """
+    with open(source, "rb") as f:
+        atomic_write(destination, f.read())
+
+
+def job_paths(name, output_root = OUTPUT_ROOT):
+    """
+    Determines where the files of a job are written.
+    Parameters:
+    -name: job name, e.g. from job_name() [string]
+    -output_root: directory holding the output of all jobs [string]
+    Returns: paths with a key for each of FORMAT_EXTENSIONS, and preview [dict]
+    """
+    base = os.path.join(output_root, name)
+    paths = {output_format: base + extension
+             for output_format, extension in FORMAT_EXTENSIONS.items()}
+    paths["preview"] = base + ".preview.png"
+    return paths
+
+
+def run_lilypond(filename = 'test.ly', timeout = None, output_dir = None, formats = None):
+    """
+    Runs Lilypond on a file and waits for it to finish.
+    Lilypond is required, and needs to be placed in the same directory as the main program.
+    It can be downloaded here (https://lilypond.org/doc/v2.25/Documentation/web/index)
+    Parameters:
+    -filename: Lilypond file to compile [string]
+    -timeout: seconds to wait before giving up on Lilypond, defaults to LILYPOND_TIMEOUT [float]
+    -output_dir: where to put the PDF, defaults to the directory of the file [string]
+    -formats: formats to engrave, a selection of ENGRAVED_FORMATS; None for just a PDF [tuple]
+    Returns: result with keys file, status ("ok", "failed", "crashed", "timeout" or "error"),
+    error (see lilypond_error), returncode, stderr, outputs (files produced) and elapsed [dict]
+    """
+    result = run_lilypond_command(lilypond_format_arguments(formats) + [os.path.abspath(filename)],
+                                  output_dir or os.path.dirname(filename) or ".", timeout)
+    result["file"] = filename
+    return result
+
+
+def run_lilypond_source(lilypond_script, basename = "score", output_dir = None,
+                        formats = ("pdf",), timeout = None):
+    """
+    Pipes a Lilypond script straight into Lilypond (lilypond -), without writing a .ly file.
+    Parameters:
+    -lilypond_script: full Lilypond script, e.g. from make_ly_script,
+    or its fragments, e.g. from iter_ly_script [string or iterable]
+    -basename: name of the output files, without extension [string]
+    -output_dir: where to put the output files, None to return them in memory [string]
+    -formats: formats to engrave, a selection of ENGRAVED_FORMATS, e.g. ("pdf", "svg") [tuple]
+    -timeout: seconds to wait before giving up on Lilypond [float]
+    Returns: result as for run_lilypond, with the output in outputs (files)
+    or, if output_dir is None, in files (file name: contents as bytes) [dict]
+    """
+    result = run_lilypond_command(lilypond_format_arguments(formats) + ["-o", basename, "-"],
+                                  output_dir, timeout, lilypond_script)
+    result["file"] = None
+    return result
+
+
+def run_lilypond_command(arguments, output_dir = None, timeout = None, source = None):
+    """
+    Runs Lilypond with the given arguments and collects the files it produces.
+    Each run works in its own temporary directory, so runs on files with the same name
+    never see each other's intermediate files. Finished files are then moved to output_dir.
+    Lilypond runs in its own process group under the limits in LILYPOND_MEMORY_LIMIT and
+    LILYPOND_CPU_LIMIT; on timeout the whole group is killed, including any Ghostscript
+    process Lilypond started.
+    Parameters:
+    -arguments: command line arguments for Lilypond [list]
+    -output_dir: where to move the produced files, None to read them into memory [string]
+    -timeout: seconds to wait before giving up on Lilypond, defaults to LILYPOND_TIMEOUT [float]
+    -source: Lilypond script (or its fragments) to send to Lilypond's standard input [string]
+    Returns: result with keys status ("ok", "failed", "crashed", "timeout" or "error"),
+    error (see lilypond_error), returncode, stderr, outputs (files produced),
+    files (in-memory output) and elapsed [dict]
+    """
+    result = {"status": "ok", "returncode": None, "stderr": "",
+              "outputs": [], "files": {}, "elapsed": 0.0}
+    start = time.perf_counter()
+    if timeout is None:
+        timeout = LILYPOND_TIMEOUT
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=".lilypond-", dir=output_dir)
+    try:
+        # Lilypond's messages go to a temporary file rather than a pipe,
+        # so a chatty run can never block while its input is still being written
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as log:
+            process = subprocess.Popen([os.path.abspath(LILYPOND_PATH)] + arguments, cwd=work_dir,
+                                       stdin=subprocess.DEVNULL if source is None else subprocess.PIPE,
+                                       stdout=subprocess.DEVNULL, stderr=log, text=True,
+                                       start_new_session=os.name == "posix")
+            limit_process(process.pid)
+            if source is not None:
+                threading.Thread(target=feed_lilypond, args=(process, source), daemon=True).start()
+            try:
+                result["returncode"] = process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                kill_process_group(process)
+                raise
+            log.seek(0)
+            result["stderr"] = log.read()
+
+        if result["returncode"] < 0: # Killed by a signal
+            result["status"] = "crashed"
+        elif result["returncode"] > 0:
+            result["status"] = "failed"
+
+        # Collect finished files (PDF, PNG, MIDI) from the working directory
+        for name in sorted(os.listdir(work_dir)):
+            if output_dir is None:
+                with open(os.path.join(work_dir, name), "rb") as f:
+                    result["files"][name] = f.read()
+            else:
+                output = os.path.join(output_dir, name)
+                os.replace(os.path.join(work_dir, name), output)
+                result["outputs"].append(output)
+    except subprocess.TimeoutExpired:
+        result["status"] = "timeout"
+    except OSError as error:
+        result["status"] = "error"
+        result["stderr"] = str(error)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result["elapsed"] = time.perf_counter() - start
+    result["error"] = lilypond_error(result, timeout)
+    pdf_bytes = sum(len(data) for name, data in result["files"].items() if name.endswith(".pdf"))
+    pdf_bytes += sum(os.path.getsize(name) for name in result["outputs"] if name.endswith(".pdf"))
+    emit_event("lilypond", duration=result["elapsed"], status=result["status"],
+               returncode=result["returncode"], stderr=result["stderr"], pdf_bytes=pdf_bytes,
+               error=result["error"]["type"] if result["error"] else None)
+    return result
+
+
+def feed_lilypond(process, source):
+    """
+    Writes a Lilypond script to the standard input of a running Lilypond process.
+    Parameters:
+    -process: running Lilypond process [subprocess.Popen]
+    -source: Lilypond script or its fragments [string or iterable]
+    """
+    try:
+        write_ly_stream(source, process.stdin)
+        process.stdin.close()
+    except (BrokenPipeError, ValueError):
+        pass # Lilypond stopped reading, e.g. after a timeout; its exit status tells the story
+
+
+def compile_with_retry(filename, timeout = None, retries = 1, source = None, breaker = None,
+                       formats = None):
+    """
+    Runs Lilypond on a file, trying again if Lilypond crashes.
+    Failures caused by the file itself (e.g., syntax errors) and timeouts are not retried.
+    Parameters:
+    -filename: Lilypond file to compile [string]
+    -timeout: seconds to allow each attempt [float]
+    -retries: number of extra attempts after a crash [int]
+    -source: Lilypond script to stream to Lilypond instead of reading filename;
+    the output is then named and placed as if filename had been compiled. A function
+    returning the script (or its fragments) is called as each attempt starts, so the
+    script is only generated when it is compiled [string or function]
+    -breaker: circuit breaker shared by the runs of a batch; while it is open the run
+    waits, and once it has given up the file is skipped [CircuitBreaker]
+    -formats: formats to engrave, None for just a PDF (see run_lilypond) [tuple]
+    Returns: result of the last attempt, with the number of attempts added;
+    status "skipped" if the breaker gave up [dict]
+    """
+    ticket = breaker.allow() if breaker is not None else None
+    if ticket is False:
+        return skipped_result(filename, breaker)
+    result = {"status": "crashed"} # Recorded if an attempt raises instead of returning
+    try:
+        for attempt in range(1, retries + 2):
+            if source is None:
+                result = run_lilypond(filename, timeout, formats=formats)
+            else:
+                result = run_lilypond_source(source() if callable(source) else source,
+                                             os.path.splitext(os.path.basename(filename))[0],
+                                             os.path.dirname(filename) or ".",
+                                             formats or ("pdf",), timeout)
+                result["file"] = filename
+            result["attempts"] = attempt
+            if result["status"] != "crashed":
+                break
+    finally:
+        # Always counted, so a trial run that raises still lets the other runs through
+        if breaker is not None:
+            breaker.record(result, ticket)
+    return result
+
+
+def compile_ly_files(filenames, workers = None, timeout = None, retries = 1, max_queued = None,
+                     sources = None, batch_size = 1, breaker = None, formats = None):
+    """
+    Compiles many Lilypond files at once, running one Lilypond process per worker.
+    Only max_queued files are handed to the pool at a time, so very large batches
+    do not build up an unbounded queue.
+    Parameters:
+    -filenames: Lilypond files to compile [list]
+    -workers: number of Lilypond processes to run at once, defaults to the number of cores [int]
+    -timeout: seconds to allow each Lilypond run [float]
+    -retries: number of extra attempts for a crashed run [int]
+    -max_queued: number of files queued or running at a time, defaults to twice the workers [int]
+    -sources: Lilypond scripts to stream instead of reading the files, one per filename,
+    or functions returning them (see compile_with_retry) [list]
+    -batch_size: files to compile per Lilypond run; above 1, a LilypondWorkerPool is used [int]
+    -breaker: circuit breaker that backs off while Lilypond keeps failing [CircuitBreaker]
+    -formats: formats to engrave for every file, None for just a PDF (see run_lilypond) [tuple]
+    Returns: one result per file, in the same order as filenames [list of dicts]
+    """
+    workers = workers or os.cpu_count() or 1
+    if batch_size > 1:
+        with LilypondWorkerPool(workers, batch_size, timeout=timeout, max_queued=max_queued,
+                                formats=formats, breaker=breaker) as pool:
+            futures = [pool.submit(filename, sources[index] if sources else None,
+                                   os.path.splitext(os.path.basename(filename))[0],
+                                   os.path.dirname(filename) or ".")
+                       for index, filename in enumerate(filenames)]
+            return [future.result() for future in futures]
+
+    max_queued = max(max_queued or 2 * workers, workers)
+    results = [None] * len(filenames)
+    pending = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for index, filename in enumerate(filenames):
+            # Wait for a slot in the queue before submitting more work
+            if len(pending) >= max_queued:
+                done, _ = concurrent.futures.wait(pending,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+            source = sources[index] if sources else None
+            pending[pool.submit(compile_with_retry, filename, timeout, retries, source,
+                                breaker, formats)] = index
+
+        for future in concurrent.futures.as_completed(pending):
+            results[pending[future]] = future.result()
+
+    return results
+
+
+#---Governing Lilypond runs---
+def limit_process(pid):
+    """
+    Applies LILYPOND_MEMORY_LIMIT and LILYPOND_CPU_LIMIT to a running process.
+    Limits are set from outside with prlimit, which is safe to call from worker threads
+    (unlike a preexec_fn), and are skipped where prlimit is not available.
+    Parameter: process ID [int]
+    """
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    try:
+        if LILYPOND_MEMORY_LIMIT is not None:
+            resource.prlimit(pid, resource.RLIMIT_AS,
+                             (LILYPOND_MEMORY_LIMIT, LILYPOND_MEMORY_LIMIT))
+        if LILYPOND_CPU_LIMIT is not None:
+            # SIGXCPU at the limit, then SIGKILL shortly after if it is ignored
+            resource.prlimit(pid, resource.RLIMIT_CPU,
+                             (int(LILYPOND_CPU_LIMIT), int(LILYPOND_CPU_LIMIT) + 5))
+    except (OSError, ValueError):
+        pass # The process has already finished
+
+
+def kill_process_group(process):
+    """
+    Kills a process started by run_lilypond_command along with any process it started,
+    and waits for it to exit.
+    Parameter: the process [subprocess.Popen]
+    """
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def lilypond_error(result, timeout = None):
+    """
+    Describes why a Lilypond run failed, for results and metrics.
+    Parameters:
+    -result: result from run_lilypond_command [dict]
+    -timeout: the timeout the run was given [float]
+    Returns: error with keys type ("timeout", "cpu_limit", "memory_limit", "crashed",
+    "failed" or "error"), message, returncode and signal (name of the signal that stopped
+    Lilypond, if any), or None if the run succeeded [dict]
+    """
+    if result["status"] == "ok":
+        return None
+    error = {"type": result["status"], "message": "", "returncode": result["returncode"],
+             "signal": None}
+    if result["returncode"] is not None and result["returncode"] < 0:
+        try:
+            error["signal"] = signal.Signals(-result["returncode"]).name
+        except ValueError:
+            pass
+
+    stderr = result["stderr"].lower()
+    if result["status"] == "timeout":
+        error["message"] = "no result after " + format(timeout, "g") + " seconds"
+    elif error["signal"] == "SIGXCPU" or (error["signal"] == "SIGKILL" and LILYPOND_CPU_LIMIT
+                                         and result["elapsed"] >= LILYPOND_CPU_LIMIT):
+        error["type"] = "cpu_limit"
+        error["message"] = "used more than " + format(LILYPOND_CPU_LIMIT, "g") + " seconds of CPU"
+    elif any(message in stderr for message in OUT_OF_MEMORY_MESSAGES):
+        error["type"] = "memory_limit"
+        error["message"] = "ran out of memory"
+    else:
+        # The last error Lilypond reported, or its last message
+        lines = [line.strip() for line in result["stderr"].splitlines() if line.strip()]
+        errors = [line for line in lines if "error" in line.lower()]
+        error["message"] = (errors or lines or [error["signal"] or ""])[-1]
+    return error
+
+
+def skipped_result(filename, breaker):
+    """
+    Builds the result for a file that was not compiled because a circuit breaker gave up.
+    Returns: result as for run_lilypond, with status "skipped" [dict]
+    """
+    return {"file": filename, "status": "skipped", "returncode": None, "stderr": "",
+            "outputs": [], "files": {}, "elapsed": 0.0, "attempts": 0,
+            "error": {"type": "circuit_open", "returncode": None, "signal": None,
+                      "message": "Lilypond kept failing, gave up after " +
+                                 str(breaker.trips - 1) + " cool-downs"}}
+
+
+class CircuitBreaker:
+    """
+    Backs off when Lilypond keeps failing, e.g. when it is missing, crashing on start-up
+    or the machine is out of memory, instead of running every remaining job into the
+    same failure. After failure_threshold failures in a row (see BREAKER_FAILURES)
+    the breaker opens: runs wait for a cool-down, which doubles each time it opens again,
+    then one run at a time tries Lilypond again. A success closes it. While it is open,
+    only the trial run's failure counts, not those of runs that were already under way.
+    After max_trips openings in a row, it gives up and allow() returns False.
+    Parameters:
+    -failure_threshold: failures in a row that open the breaker [int]
+    -cooldown: seconds to wait the first time it opens [float]
+    -max_cooldown: longest wait [float]
+    -max_trips: openings in a row before giving up, None to never give up [int]
+    """
+    def __init__(self, failure_threshold = 5, cooldown = 10.0, max_cooldown = 300.0,
+                 max_trips = 3):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_trips = max_trips
+        self.failures = 0
+        self.trips = 0
+        self.open_until = None
+        self.lock = threading.Lock()
+        self.trial = threading.Lock() # Held by the one run trying Lilypond after a cool-down
+
+    @property
+    def state(self):
+        """
+        Returns: "closed", "open" (cooling down), "half-open" (trying again) or "gave up" [string]
+        """
+        with self.lock:
+            if self.open_until is None:
+                return "closed"
+            if self.max_trips is not None and self.trips > self.max_trips:
+                return "gave up"
+            return "open" if time.monotonic() < self.open_until else "half-open"
+
+    def allow(self):
+        """
+        Waits until a run may go ahead.
+        Returns: False if the breaker has given up, otherwise a ticket
+        to pass to record() with the run's result [dict]
+        """
+        while True:
+            with self.lock:
+                if self.open_until is None:
+                    return {"trial": False}
+                if self.max_trips is not None and self.trips > self.max_trips:
+                    return False
+                delay = self.open_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif self.trial.acquire(blocking=False):
+                return {"trial": True} # This run tries Lilypond; record() lets the others through
+            else:
+                time.sleep(min(1.0, self.cooldown))
+
+    def record(self, result, ticket = None):
+        """
+        Counts the outcome of a run.
+        Parameters:
+        -result: result from run_lilypond or compile_with_retry [dict]
+        -ticket: the ticket allow() gave the run [dict]
+        """
+        trial = ticket is not None and ticket["trial"]
+        with self.lock:
+            if result["status"] not in BREAKER_FAILURES:
+                self.failures = 0
+                self.trips = 0
+                self.open_until = None
+            elif self.open_until is None or trial:
+                self.failures += 1
+                # A failed trial opens it again straight away
+                if self.failures >= self.failure_threshold or trial:
+                    self.trips += 1
+                    self.failures = 0
+                    wait = min(self.cooldown * 2 ** (self.trips - 1), self.max_cooldown)
+                    self.open_until = time.monotonic() + wait
+                    emit_event("circuit_open", trips=self.trips, cooldown=wait,
+                               status=result["status"])
+            # Other failures while open come from runs started before it opened
+        if trial:
+            self.trial.release()
+
+
+#---Functions for previews---
+def run_preview(name_of_scale, pattern, settings, output_file, timeout = None):
+    """
+    Engraves the first staff block of a book as a low-resolution PNG image,
+    using Lilypond's preview mode, which crops the image to the music.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -output_file: where to write the image [string]
+    -timeout: seconds to wait before giving up on Lilypond [float]
+    Returns: result as for run_lilypond, with output set to output_file if the image was made [dict]
+    """
+    with trace_stage("preview") as event:
+        result = run_lilypond_command(
+            ["--formats=png", "-dpreview", "-dno-print-pages",
+             "-dresolution=" + str(PREVIEW_RESOLUTION), "-o", "preview", "-"],
+            timeout=timeout, source=make_preview_script(name_of_scale, pattern, settings))
+        images = sorted((not name.endswith(".preview.png"), name)
+                        for name in result["files"] if name.endswith(".png"))
+        result["output"] = None
+        if result["status"] == "ok" and images:
+            atomic_write(output_file, result["files"][images[0][1]])
+            result["output"] = output_file
+        event["error"] = None if result["output"] else result["status"]
+    return result
+
+
+def compile_in_background(filename, timeout = None):
+    """
+    Starts Lilypond on a file in a background thread and returns straight away.
+    The program waits for the compile to finish before exiting.
+    Parameters:
+    -filename: Lilypond file to compile [string]
+    -timeout: seconds to wait before giving up on Lilypond [float]
+    Returns: future holding the result of run_lilypond [concurrent.futures.Future]
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(run_lilypond, filename, timeout)
+    executor.shutdown(wait=False)
+    return future
+
+
+#---Output formats---
+def lilypond_format_arguments(formats):
+    """
+    Works out the Lilypond options that engrave several formats in a single run.
+    PDF and PNG come from Lilypond's default backend. SVG needs another backend:
+    the SVG backend on its own, or the Cairo backend (Lilypond 2.24 and later), which
+    writes SVG alongside PDF and PNG in the same run.
+    Parameter: formats to engrave, a selection of ENGRAVED_FORMATS; None for just a PDF [tuple]
+    Returns: command line arguments for Lilypond [list]
+    """
+    if formats is None:
+        return []
+    formats = [output_format for output_format in ENGRAVED_FORMATS if output_format in formats]
+    if "svg" not in formats:
+        return ["--formats=" + ",".join(formats)]
+    if formats == ["svg"]:
+        return ["-dbackend=svg"]
+    return ["-dbackend=cairo", "--formats=" + ",".join(formats)]
+
+
+def render_formats(name_of_scale, pattern, settings, formats, output_dir = None,
+                   basename = "score", timeout = None):
+    """
+    Produces a book in several formats from one generated script. All the engraved formats
+    come from a single Lilypond run; the Lilypond script, MIDI and MusicXML need no engraving.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -formats: formats to produce, keys of FORMAT_EXTENSIONS [tuple]
+    -output_dir: where to write the files, None to return them in memory [string]
+    -basename: name of the output files, without extension [string]
+    -timeout: seconds to allow the Lilypond run [float]
+    Returns: result as for run_lilypond_source, with the files of every format [dict]
+    """
+    unknown = [output_format for output_format in formats if output_format not in FORMAT_EXTENSIONS]
+    if unknown:
+        raise ValueError("Unknown output format: " + ", ".join(unknown))
+
+    lilypond_script = None
+    engraved = tuple(output_format for output_format in ENGRAVED_FORMATS if output_format in formats)
+    if engraved or "ly" in formats:
+        lilypond_script = generate_ly_script(name_of_scale, pattern, settings)
+    if engraved:
+        result = run_lilypond_source(lilypond_script, basename, output_dir, engraved, timeout)
+    else:
+        result = {"file": None, "status": "ok", "error": None, "returncode": None, "stderr": "",
+                  "outputs": [], "files": {}, "elapsed": 0.0}
+
+    writers = {"ly": lambda: lilypond_script.encode("utf-8"),
+               "midi": lambda: make_midi(name_of_scale, pattern, settings),
+               "musicxml": lambda: make_musicxml(name_of_scale, pattern, settings)}
+    for output_format, writer in writers.items():
+        if output_format not in formats:
+            continue
+        with trace_stage(output_format):
+            data = writer()
+        name = basename + FORMAT_EXTENSIONS[output_format]
+        if output_dir is None:
+            result["files"][name] = data
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            atomic_write(os.path.join(output_dir, name), data)
+            result["outputs"].append(os.path.join(output_dir, name))
+    return result
+
+
+#---Functions for incremental compilation---
+def build_incremental(name_of_scale, pattern, settings, output_pdf, fragment_dir = FRAGMENT_DIR,
+                      per_mode = False, workers = None, timeout = None):
+    """
+    Builds the PDF of a book from separately compiled fragments (see iter_ly_fragments).
+    Each fragment is stored under the hash of its script, so only fragments whose script
+    changed since an earlier build are compiled; the rest are reused. The fragment PDFs are
+    then merged into output_pdf, and a manifest of what each fragment was built from is
+    written next to it (<output>.fragments.json).
+    Parameters:
+    -name_of_scale: the full name of the scale [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -output_pdf: PDF file to create [string]
+    -fragment_dir: directory holding the compiled fragments [string]
+    -per_mode: split by mode as well as by key [bool]
+    -workers: number of Lilypond processes to run at once [int]
+    -timeout: seconds to allow each Lilypond run [float]
+    Returns: the manifest, with keys status, output, fragments, compiled and reused [dict]
+    """
+    os.makedirs(fragment_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(output_pdf) or ".", exist_ok=True)
+    fragments = []
+    to_compile = []
+
+    for key, mode, fragment_script in iter_ly_fragments(name_of_scale, pattern, settings,
+                                                        per_mode):
+        digest = hashlib.sha256(fragment_script.encode("utf-8")).hexdigest()
+        ly_file = os.path.join(fragment_dir, digest + ".ly")
+        pdf_file = os.path.join(fragment_dir, digest + ".pdf")
+        reused = os.path.isfile(pdf_file)
+        if not reused:
+            atomic_write(ly_file, fragment_script)
+            to_compile.append(ly_file)
+        fragments.append({"key": key, "mode": mode, "hash": digest, "pdf": pdf_file,
+                          "reused": reused})
+
+    compile_results = compile_ly_files(to_compile, workers, timeout)
+    failed = [result for result in compile_results if result["status"] != "ok"]
+
+    manifest = {"status": "ok", "output": output_pdf,
+                "inputs": {"scale": name_of_scale, "intervals": ALLOWED_SCALES[name_of_scale],
+                           "pattern": list(pattern), "settings": dict(settings),
+                           "version": LILYPOND_HEADER},
+                "fragments": fragments, "compiled": len(to_compile),
+                "reused": len(fragments) - len(to_compile)}
+    if failed:
+        manifest["status"] = "error"
+        manifest["error"] = "Lilypond " + failed[0]["status"] + " on " + failed[0]["file"]
+    else:
+        merge = merge_pdfs([fragment["pdf"] for fragment in fragments], output_pdf, timeout)
+        if merge["status"] != "ok":
+            manifest["status"] = "error"
+            manifest["error"] = "Merging failed: " + merge["stderr"]
+
+    atomic_write(os.path.splitext(output_pdf)[0] + ".fragments.json",
+                 json.dumps(manifest, indent=2))
+    return manifest
+
+
+def merge_pdfs(pdf_files, output_file, timeout = None, bookmarks = None):
+    """
+    Joins PDFs into one with Ghostscript (GHOSTSCRIPT_PATH).
+    The merged file is written to a temporary file and renamed into place.
+    Parameters:
+    -pdf_files: PDFs to join, in order [list]
+    -output_file: PDF to create [string]
+    -timeout: seconds to allow Ghostscript [float]
+    -bookmarks: entries for the PDF outline, as (title, page number from 1) [list of tuples]
+    Returns: result with keys status ("ok", "failed", "timeout" or "error") and stderr [dict]
+    """
+    result = {"status": "ok", "stderr": ""}
+    if len(pdf_files) == 1 and not bookmarks:
+        atomic_copy(pdf_files[0], output_file)
+        return result
+
+    handle, temp_name = tempfile.mkstemp(dir=os.path.dirname(output_file) or ".",
+                                         prefix="." + os.path.basename(output_file), suffix=".tmp")
+    os.close(handle)
+    marks_name = None
+    try:
+        inputs = list(pdf_files)
+        if bookmarks:
+            # pdfmark commands, read by Ghostscript after the pages
+            handle, marks_name = tempfile.mkstemp(suffix=".ps")
+            with os.fdopen(handle, "w", encoding="latin-1", errors="replace") as f:
+                for title, page in bookmarks:
+                    f.write("[ /Title " + pdf_string(title) + " /Page " + str(page) +
+                            " /OUT pdfmark\n")
+            inputs.append(marks_name)
+        completed = subprocess.run([GHOSTSCRIPT_PATH, "-q", "-dBATCH", "-dNOPAUSE", "-dSAFER",
+                                    "-sDEVICE=pdfwrite", "-sOutputFile=" + temp_name] + inputs,
+                                   capture_output=True, text=True, timeout=timeout, check=False)
+        if completed.returncode == 0:
+            os.replace(temp_name, output_file)
+        else:
+            result["status"] = "failed"
+            result["stderr"] = completed.stderr
+    except subprocess.TimeoutExpired:
+        result["status"] = "timeout"
+    except OSError as error:
+        result["status"] = "error"
+        result["stderr"] = str(error)
+    finally:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        if marks_name is not None:
+            os.remove(marks_name)
+    return result
+
+
+def pdf_string(text):
+    """
+    Writes text as a PDF/PostScript string literal, e.g. (C major).
+    Returns: string literal [string]
+    """
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def pdf_page_count(pdf_file):
+    """
+    Counts the pages of a PDF from its page objects. Lilypond writes PDF 1.4,
+    which has no compressed object streams, so the page objects can be read directly.
+    Parameter: PDF file [string]
+    Returns: number of pages [int]
+    """
+    with open(pdf_file, "rb") as f:
+        return len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", f.read()))
+
+
+#---Functions for splitting books into volumes---
+def build_volumes(name_of_scale, pattern, settings, output_pdf, keys_per_volume = None,
+                  page_budget = None, workers = None, timeout = None, breaker = None):
+    """
+    Builds the PDF of a book by compiling it as several volumes at once
+    (see iter_ly_volumes) and merging them, with a bookmark for each volume.
+    Lilypond's page breaking gets slower than linearly on long scores and uses one core,
+    so smaller volumes in parallel finish much sooner than one huge score.
+    Each volume starts on a new page.
+    Parameters:
+    -name_of_scale: the full name of the scale [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -output_pdf: PDF file to create [string]
+    -keys_per_volume: keys in each volume [int]
+    -page_budget: estimated pages allowed in each volume [float]
+    -workers: number of Lilypond processes to run at once [int]
+    -timeout: seconds to allow each Lilypond run [float]
+    -breaker: circuit breaker that backs off while Lilypond keeps failing [CircuitBreaker]
+    Returns: result with keys status, output, error and volumes (keys, estimated and actual
+    pages and the first page of each) [dict]
+    """
+    output_dir = os.path.dirname(output_pdf) or "."
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=".volumes-", dir=output_dir)
+    result = {"status": "ok", "output": output_pdf, "error": None, "volumes": []}
+    try:
+        filenames = []
+        for number, volume in enumerate(iter_ly_volumes(name_of_scale, pattern, settings,
+                                                        keys_per_volume, page_budget), 1):
+            filenames.append(os.path.join(work_dir, "volume" + str(number) + ".ly"))
+            atomic_write(filenames[-1], volume["script"])
+            result["volumes"].append({"keys": volume["keys"],
+                                      "estimated_pages": volume["estimated_pages"]})
+
+        compile_results = compile_ly_files(filenames, workers, timeout, breaker=breaker)
+        failed = [compiled for compiled in compile_results if compiled["status"] != "ok"]
+        if failed:
+            result["status"] = "error"
+            result["error"] = ("Lilypond " + failed[0]["status"] + " on volume " +
+                               str(compile_results.index(failed[0]) + 1))
+            return result
+
+        bookmarks = []
+        page = 1
+        for volume, filename in zip(result["volumes"], filenames):
+            pdf_file = os.path.splitext(filename)[0] + ".pdf"
+            volume["first_page"] = page
+            volume["pages"] = pdf_page_count(pdf_file)
+            letters = [LY_TO_LETTER.get(key, key) for key in volume["keys"]]
+            bookmarks.append((", ".join(letters) + " " + name_of_scale, page))
+            page += volume["pages"]
+
+        merge = merge_pdfs([os.path.splitext(filename)[0] + ".pdf" for filename in filenames],
+                           output_pdf, timeout, bookmarks)
+        if merge["status"] != "ok":
+            result["status"] = "error"
+            result["error"] = "Merging failed: " + merge["stderr"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+#---Long-running Lilypond workers---
+class LilypondWorkerPool:
+    """
+    Keeps a set of worker threads that compile many documents per Lilypond process.
+    Most of the time of a short exercise goes on Lilypond starting up (loading Guile,
+    fonts and its Scheme libraries), so each worker collects up to batch_size queued
+    documents and passes them all to one Lilypond run, which compiles each input file
+    in turn to its own output. This gives every document its own PDF without having to
+    split a combined \\book afterwards.
+    If a shared run fails, the documents that produced no output are retried one by one,
+    so one bad document cannot fail the others.
+    Usage:
+        with LilypondWorkerPool() as pool:
+            future = pool.submit(source=generate_ly_script("major", [1, 2, 3, 5], settings),
+                                 basename="major", output_dir="output")
+            result = future.result()
+    """
+
+    def __init__(self, workers = None, batch_size = 8, batch_wait = 0.05, timeout = None,
+                 max_queued = None, formats = None, breaker = None):
+        """
+        Starts the workers.
+        Parameters:
+        -workers: number of Lilypond processes to run at once, defaults to the number of cores [int]
+        -batch_size: most documents to compile in one Lilypond run [int]
+        -batch_wait: seconds a worker waits for more documents before starting a run [float]
+        -timeout: seconds to allow each Lilypond run, defaults to LILYPOND_TIMEOUT [float]
+        -max_queued: documents that can wait in the queue before submit blocks, 0 for no limit [int]
+        -formats: formats to engrave for every document, None for just a PDF [tuple]
+        -breaker: circuit breaker checked before each Lilypond run; once it gives up,
+        the remaining documents are skipped [CircuitBreaker]
+        """
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.formats = formats
+        self.breaker = breaker
+        workers = workers or os.cpu_count() or 1
+        self.jobs = queue.Queue(maxsize=2 * workers * self.batch_size if max_queued is None
+                                else max_queued)
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, filename = None, source = None, basename = None, output_dir = None):
+        """
+        Queues a document for compilation.
+        Parameters:
+        -filename: Lilypond file to compile [string]
+        -source: Lilypond script to compile instead of a file, or a function returning it,
+        called when the document is compiled [string, iterable or function]
+        -basename: name of the output files, defaults to the name of the file (or "score") [string]
+        -output_dir: where to put the output, defaults to the directory of the file;
+        None with a source returns the output in memory, as run_lilypond_source does [string]
+        Returns: future resolving to a result like run_lilypond's [concurrent.futures.Future]
+        """
+        if filename is not None:
+            basename = basename or os.path.splitext(os.path.basename(filename))[0]
+            output_dir = output_dir or os.path.dirname(filename) or "."
+        if source is not None and not isinstance(source, str) and not callable(source):
+            source = "".join(source)
+        job = {"file": filename, "source": source, "basename": basename or "score",
+               "output_dir": output_dir, "future": concurrent.futures.Future()}
+        self.jobs.put(job)
+        return job["future"]
+
+    def map(self, filenames):
+        """
+        Compiles many files and waits for them all.
+        Returns: one result per file, in order [list of dicts]
+        """
+        futures = [self.submit(filename) for filename in filenames]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Finishes the queued documents and stops the workers.
+        """
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def work(self):
+        """
+        Worker loop: takes batches of documents from the queue and compiles them.
+        """
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    job = self.jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.jobs.put(None) # Leave the stop signal for this worker's next loop
+                    break
+                batch.append(job)
+
+            ticket = self.breaker.allow() if self.breaker is not None else None
+            if ticket is False:
+                for job in batch:
+                    job["future"].set_result(skipped_result(job["file"], self.breaker))
+                continue
+
+            try:
+                self.compile_batch(batch)
+            except Exception as error: # Never leave a caller waiting on a lost future
+                for job in batch:
+                    if not job["future"].done():
+                        job["future"].set_exception(error)
+            if self.breaker is not None:
+                self.breaker.record(self.batch_outcome(batch), ticket)
+
+    def batch_outcome(self, batch):
+        """
+        Sums up a compiled batch for the circuit breaker: ok if any document was engraved,
+        otherwise the result of the first document.
+        Returns: result with at least a status [dict]
+        """
+        results = [job["future"].result() for job in batch if job["future"].exception() is None]
+        for result in results:
+            if result["status"] not in BREAKER_FAILURES:
+                return result
+        return results[0] if results else {"status": "error"}
+
+    def compile_batch(self, batch):
+        """
+        Compiles a batch of documents in one Lilypond run, then retries the documents
+        without output one at a time if the batch held more than one.
+        """
+        with tempfile.TemporaryDirectory(prefix=".lilypond-batch-") as input_dir:
+            inputs = []
+            for index, job in enumerate(batch):
+                input_file = os.path.join(input_dir, "doc" + str(index) + ".ly")
+                if job["source"] is None:
+                    shutil.copyfile(job["file"], input_file)
+                else:
+                    atomic_write(input_file, job["source"]() if callable(job["source"])
+                                 else job["source"])
+                inputs.append(input_file)
+
+            run = run_lilypond_command(lilypond_format_arguments(self.formats) + inputs, None,
+                                       self.timeout)
+
+        for index, job in enumerate(batch):
+            prefix = "doc" + str(index)
+            files = {job["basename"] + name[len(prefix):]: data for name, data in run["files"].items()
+                     if re.match(re.escape(prefix) + r"[.-]", name)}
+
+            if len(batch) > 1 and run["status"] != "ok" and not files:
+                # Compile this one on its own, so the cause of the failure is isolated
+                self.compile_batch([job])
+                continue
+
+            result = {"file": job["file"], "status": run["status"], "returncode": run["returncode"],
+                      "stderr": lilypond_messages(run["stderr"], os.path.basename(inputs[index])),
+                      "outputs": [], "files": {}, "elapsed": run["elapsed"],
+                      "batch_size": len(batch)}
+            if files and result["status"] != "ok":
+                result["status"] = "ok" # Another document failed the shared run
+            result["error"] = lilypond_error(result, self.timeout or LILYPOND_TIMEOUT)
+            if job["output_dir"] is None:
+                result["files"] = files
+            else:
+                os.makedirs(job["output_dir"], exist_ok=True)
+                for name, data in files.items():
+                    output = os.path.join(job["output_dir"], name)
+                    atomic_write(output, data)
+                    result["outputs"].append(output)
+            job["future"].set_result(result)
+
+
+def lilypond_messages(stderr, input_name):
+    """
+    Picks out the messages about one input file from the output of a Lilypond run
+    over several files. Lilypond starts each file with "Processing `<file>'".
+    Parameters:
+    -stderr: messages from the whole run [string]
+    -input_name: file name of the input, as passed to Lilypond [string]
+    Returns: messages for that file, or all messages if they cannot be split [string]
+    """
+    sections = re.split(r"(?=^Processing `)", stderr, flags=re.MULTILINE)
+    for section in sections:
+        if section.startswith("Processing `") and input_name in section.split("\n", 1)[0]:
+            return section
+    return stderr
+
+
+#---Functions for caching generated files---
+def cache_key(name_of_scale, pattern, settings):
+    """
+    Builds the cache key for a job: a hash of its normalized inputs
+    and the Lilypond version header, since identical inputs give identical output.
+    Parameters:
+    -name_of_scale: the full name of the scale [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    Returns: cache key as a hex digest [string]
+    """
+    full_settings = dict(DEFAULT_SETTINGS)
+    full_settings.update(settings)
+    inputs = {"scale": name_of_scale, "intervals": ALLOWED_SCALES[name_of_scale],
+              "pattern": list(pattern), "settings": full_settings, "version": LILYPOND_HEADER}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def cache_lookup(key, cache_dir = CACHE_DIR):
+    """
+    Looks up a cache entry and marks it as recently used.
+    Returns: directory of the entry, or None if it is not cached [string]
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isfile(os.path.join(entry_dir, "score.ly")):
+        return None
+    os.utime(entry_dir) # Last-used time for LRU eviction
+    return entry_dir
+
+
+def cache_store(key, lilypond_script, pdf_file = None, cache_dir = CACHE_DIR):
+    """
+    Stores a generated Lilypond script (and its PDF, if compiled) in the cache.
+    The entry is assembled in a temporary directory and renamed into place,
+    so a half-written entry is never seen by cache_lookup.
+    Returns: directory of the entry [string]
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=key + ".tmp", dir=cache_dir)
+    with open(os.path.join(temp_dir, "score.ly"), "w", encoding="utf-8") as f:
+        f.write(lilypond_script)
+    if pdf_file and os.path.isfile(pdf_file):
+        shutil.copyfile(pdf_file, os.path.join(temp_dir, "score.pdf"))
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.rename(temp_dir, entry_dir)
+    except OSError:
+        # Another job stored the same entry first
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return entry_dir
+
+
+def cache_entries(cache_dir = CACHE_DIR):
+    """
+    Lists the entries in the cache, least recently used first.
+    Returns: entries with keys key, files, size (bytes) and last_used (timestamp) [list of dicts]
+    """
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        if ".tmp" in key or not os.path.isdir(entry_dir):
+            continue
+        files = sorted(os.listdir(entry_dir))
+        size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in files)
+        entries.append({"key": key, "files": files, "size": size,
+                        "last_used": os.path.getmtime(entry_dir)})
+
+    entries.sort(key=lambda entry: entry["last_used"])
+    return entries
+
+
+def cache_evict(max_bytes = CACHE_MAX_BYTES, cache_dir = CACHE_DIR):
+    """
+    Removes least recently used entries until the cache fits in max_bytes.
+    Returns: number of entries removed [int]
+    """
+    entries = cache_entries(cache_dir)
+    total = sum(entry["size"] for entry in entries)
+    removed = 0
+
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(os.path.join(cache_dir, entry["key"]), ignore_errors=True)
+        total -= entry["size"]
+        removed += 1
+
+    return removed
+
+
+def cache_clear(cache_dir = CACHE_DIR):
+    """
+    Removes every entry from the cache.
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
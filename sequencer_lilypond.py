@@ -0,0 +1,513 @@
+"""
+File: sequencer_lilypond.py
+---
+The Lilypond emitter of the musical pattern sequencer: turns the scales and motifs
+worked out in musicalpatternsequencer into Lilypond scripts, for whole books,
+previews, per-key fragments and chord progressions. Nothing here runs Lilypond
+(see sequencer_compile).
+"""
+import functools
+import itertools
+import re
+
+from musicalpatternsequencer import (
+    ALLOWED_PROGRESSIONS, CHORD_NAMES, CHORD_SCALES, FLATS_CONVERSION, LETTER_TO_LY,
+    LILYPOND_HEADER, LY_TO_LETTER, LY_TO_TEXT, NoteSequence, SHARPS_CONVERSION, SPELLING_TABLE,
+    check_pattern_valid, determine_rhyth_val, generate_modes, int_seq_to_ly, scale_info)
+from sequencer_tracing import trace_stage
+
+# Rough page layout, for splitting books into volumes by page budget (see iter_ly_volumes)
+NOTES_PER_SYSTEM = 32
+SYSTEMS_PER_PAGE = 9
+
+
+# ---Lilypond-related conversion functions---
+def ly_scale_to_sequence(scale):
+    """
+    Generates a string in Lilypond format for the main melodic sequence of the program.
+    Uses the modal transpose feature in Lilypond.
+    Parameter:
+    -scale_list: scale as letter names in LY format [list]
+    Output: returns melody string in LY format [string]
+    """
+    return "".join(iter_ly_scale_to_sequence(scale))
+
+
+def iter_ly_scale_to_sequence(scale):
+    """
+    Yields the main melodic sequence in Lilypond format one line at a time
+    (see ly_scale_to_sequence).
+    Parameter:
+    -scale_list: scale as letter names in LY format [list]
+    """
+    from_pitch = 'c'
+
+    # Iterating along each note in the scale to repeat the motif
+    for note in scale:
+        to_pitch = note
+        yield ('\\modalTranspose ' + str(from_pitch) + " " + str(to_pitch) +
+               ' \\diatonicScale \\motif \n')
+
+    yield "\n}" # Final line break for LY legibility
+
+
+def lett_list_to_ly_list (melody):
+    """
+    Turns a given melody (in list, letter/LY format) into a list in Lilypond format
+    Can be applied repeatedly as a check without changing LY format
+    Parameters: melody as letter names in standard/LY letter format [list or NoteSequence]
+    Output: melody as LY format [list]
+    """
+    if isinstance(melody, NoteSequence):
+        return melody.ly()
+    return [lett_to_ly(note) for note in melody]
+
+
+def ly_add_slur(melody):
+    """
+    Adds LY slur notation to a given list
+    Parameter:
+    -melody: a melody in LY notation [list]
+    Returns:
+    -new melody in LY notation with slurs; the given list is left unchanged [list]
+    """
+    return [melody[0], "(", *melody[1:], ")"]
+
+
+def ly_to_lett(note):
+    """
+    Converts a given note from Lilypond letter format to standard letter format
+    E.g., "bf" -> "Bb"
+    Can be repeatedly applied without issues.
+    Parameter: note in LY format ("bf") [string]
+    Returns converted note in standard letter ("Bb") [string]
+    """
+    if note in LY_TO_LETTER:
+        return LY_TO_LETTER[note]
+    if note in LETTER_TO_LY:
+        return note
+
+    note = note.capitalize()
+    note = note.replace("f", "b")
+    note = note.replace("s", "#")
+    return note
+
+
+def lett_to_ly(note):
+    """
+    Converts a given note from standard letter format to Lilypond letter format
+    E.g., "Bb" -> "bf"
+    Parameter: note in standard or LY letter format ("Bb") [string]
+    Returns converted note in LY format ("bf") [string]
+    """
+    if note in LETTER_TO_LY:
+        return LETTER_TO_LY[note]
+    if note in LY_TO_LETTER:
+        return note
+
+    note = note.capitalize() # Added element to handle LY input
+    if note.endswith("b") and note != "b":
+        note = note.replace("b", "f")
+    note = note.replace("#", "s")
+    note = note.lower()
+    return note
+
+
+def ly_note_to_ly_text(note):
+    """
+    Converts ly format to ly markup text format
+    Parameter: note in ly note format [string]
+    Returns: text in ly text format[string]
+    """
+    if note in LY_TO_TEXT:
+        return LY_TO_TEXT[note]
+
+    note = note.capitalize() # Safeguard for LY input
+    if note.endswith("s"):
+        new_text = "\\concat{" + note.replace("s","") + "\\super\\sharp}"
+    elif note.endswith("f"):
+        new_text = "\\concat{" + note.replace("f","") + "\\super\\flat}"
+    else:
+        new_text = note
+    return new_text
+
+
+#---Functions for compiling Lilypond string---
+def ly_list_to_melody(rhythm_val, melody):
+    """
+    Converts list in LY notation to Lilypond (LY) melody notation string
+    Parameters:
+    -rhythm_val list with 4 elements at different indices (see comments for related function) [list]
+    -melody given in LY letter name notation (e.g., ['c', 'ef', 'fs']) [list]
+    Returns:
+    -melody as a string in Lilypond format, including rhythm headers [string]
+    """
+
+    # Initialize string
+    melody_string = ""
+
+    # Add octave and rhythm value notation to first pitch (plus tuplet header if appl.)
+    melody_string = (str(rhythm_val[2]) +
+                     melody_string.join(melody[0] + "'" + str(rhythm_val[0])))
+
+    # Add subsequent pitches (and tuplet header if appl.)
+    melody_string = melody_string + " " + " ".join(melody[1:]) + str(rhythm_val[3])
+
+    return melody_string
+
+
+def make_ly_script(scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual, name_of_scale, settings):
+    """
+    Converts melodic motif to a sequence over a given scale.
+    Parameters:
+    -scale: scale given in standard letter name notation e.g., ['C', 'Eb', 'F#'],
+    or as a NoteSequence spelled when the script is written [list or NoteSequence]
+    -motif: melodic motif in standard letter name notation [list or NoteSequence]
+    -rhythm_val: 4-parameter list with rhythm value information for motif [list]
+    -name_of_scale: the full name of the scale (e.g., "natural minor") [string]
+    -key_sig_qual: a string with the key signature quality (major, minor or custom) [string]
+    Returns: full Lilypond script [string]
+    """
+    return "".join(iter_ly_script(scale_let_seq, motif_let_seq, rhythm_val,
+                                  key_sig_qual, name_of_scale, settings))
+
+
+def iter_ly_script(scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual, name_of_scale, settings):
+    """
+    Yields the Lilypond script of make_ly_script as a series of fragments, in order,
+    so it can be written to a file or pipe without building the whole document in memory.
+    Takes the same parameters as make_ly_script.
+    """
+    yield ly_script_prelude(motif_let_seq, rhythm_val)
+
+    for _, _, staff_block in iter_ly_staff_blocks(scale_let_seq, rhythm_val, key_sig_qual,
+                                                  name_of_scale, settings):
+        yield staff_block
+
+
+def ly_script_prelude(motif_let_seq, rhythm_val):
+    """
+    Generates the start of the Lilypond script: the version header and the motif.
+    Parameters:
+    -motif: melodic motif in standard letter name notation [list]
+    -rhythm_val: 4-parameter list with rhythm value information for motif [list]
+    Returns: header and motif definition in LY format [string]
+    """
+    # Convert motif to lilypond format (as a list) and then to a melody string
+    motif_ly_list = ly_add_slur(lett_list_to_ly_list(motif_let_seq))
+    motif_lilyp_string = ly_list_to_melody(rhythm_val, motif_ly_list)
+
+    lilyp_header = LILYPOND_HEADER + '\n\n\\language "english"\n\n#(set-global-staff-size 20)'
+    lilyp_motif_pre = "motif = \\relative {"
+
+    return "\n".join([lilyp_header, lilyp_motif_pre, motif_lilyp_string, "}", ""])
+
+
+def iter_ly_staff_blocks(scale_let_seq, rhythm_val, key_sig_qual, name_of_scale, settings):
+    """
+    Yields the staff blocks of the Lilypond script: one per key,
+    or one per mode of each key if settings["modes"] is True.
+    Parameters are as for make_ly_script.
+    Yields: (key in LY format, mode number or None, staff block in LY format) [tuple]
+    """
+    # Convert scale to lilypond format (as a list)
+    scale_ly_list = lett_list_to_ly_list(scale_let_seq)
+
+    lilyp_scale_pre = "diatonicScale = \\relative {"
+    from_pitch = 'c'
+
+    # Generating keys to transpose over
+    keys = int_seq_to_ly(ALLOWED_PROGRESSIONS["circle of fifths"], key_sig_qual)
+
+    # Checks whether to print modes
+    if settings["modes"]:
+        # Generate melody strings for each mode of the scale once, for use in every key
+        modes_ly_list = generate_modes(scale_ly_list)
+        modes_lilyp_strings = [(ly_list_to_melody(rhythm_val, mode), ly_scale_to_sequence(mode))
+                               for mode in modes_ly_list]
+    else:
+        # Generate main melodic sequence string in LY format
+        scale_lilyp_string = ly_list_to_melody(rhythm_val, scale_ly_list)
+        lilyp_staff_melody = ly_scale_to_sequence(scale_ly_list)
+
+    # Transpose to all 12 keys
+    for key in keys:
+        # Lilypond only has major and minor key signatures; custom scales are written without one
+        key_signature = ("\n\\key " + str(key) + " \\" + str(key_sig_qual)
+                         if key_sig_qual in ("major", "minor") else "")
+
+        # Repeating sequence across all modes of scale
+        if settings["modes"]:
+            for i, (mode_lilyp_string, lilyp_mode_melody) in enumerate(modes_lilyp_strings):
+                # Add text, key sig, and melody to block string
+                lilyp_staff_block = ("\\markup {" + str(ly_note_to_ly_text(key)) + " " +
+                                     str(name_of_scale) + "}\n" +
+                                     "\\markup \\italic {" + "Mode " + str(i + 1) + "}\n" +
+                                     lilyp_scale_pre + mode_lilyp_string + "}" +
+                                     "\n\\new Staff{" + key_signature +
+                                     "\n\\transpose " + str(from_pitch) + " " + str(key) + " {\n" +
+                                     lilyp_mode_melody + "}\n")
+
+                if i == len(modes_lilyp_strings) - 1:
+                    lilyp_staff_block += "\\pageBreak\n\n" # Page break between keys
+                yield key, i + 1, lilyp_staff_block
+
+        # If modes is not True, just prints in all keys
+        else:
+            yield key, None, ("\\markup {" + ly_note_to_ly_text(key) + " " +
+                              str(name_of_scale) + "}\n" +
+                              lilyp_scale_pre + scale_lilyp_string + "}" +
+                              "\n\\new Staff{" + key_signature +
+                              "\n\\transpose " + str(from_pitch) + " " + str(key) + " {\n" +
+                              lilyp_staff_melody + "}")
+
+
+#---Functions for chord progressions---
+def ly_string(text):
+    """
+    Quotes text as a Lilypond string, so characters such as # (which starts Scheme code
+    in markup) are printed as they are.
+    Returns: quoted text in LY format [string]
+    """
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+
+def parse_chord(symbol):
+    """
+    Reads a chord symbol such as "Dm7", "Bb7" or "F#m7b5".
+    Parameter: chord symbol, with a quality from CHORD_SCALES [string]
+    Returns: root in integer notation, chord quality and root in LY format,
+    spelled as in the symbol (e.g. "fs" for F#) [tuple]
+    """
+    match = re.fullmatch(r"([A-G][b#]?)(.*)", symbol.strip())
+    # Roots such as Cb or E# have no spelling in LETTER_TO_LY
+    if match is None or match.group(2) not in CHORD_SCALES or match.group(1) not in LETTER_TO_LY:
+        raise ValueError("Unknown chord: " + symbol)
+    letter = match.group(1)
+    root = (FLATS_CONVERSION.index(letter) if letter in FLATS_CONVERSION
+            else SHARPS_CONVERSION.index(letter))
+    return root, match.group(2), LETTER_TO_LY[letter]
+
+
+def progression_chords(progression):
+    """
+    Reads a chord progression.
+    Parameter: name of a progression in ALLOWED_PROGRESSIONS, chord symbols separated by
+    spaces (e.g. "Dm7 G7 Cmaj7") or a list of chord symbols [string or list]
+    Returns: root in integer notation, chord quality and root in LY format of each chord,
+    as from parse_chord [list of tuples]
+    """
+    if isinstance(progression, str):
+        progression = ALLOWED_PROGRESSIONS.get(progression, progression.split())
+    # Plain keys, as in the circle of fifths, are taken as major chords
+    return [(chord, "", SPELLING_TABLE[(chord, "major")][1]) if isinstance(chord, int)
+            else parse_chord(chord) for chord in progression]
+
+
+@functools.lru_cache(maxsize=None)
+def chord_motif(quality, pattern):
+    """
+    Computes the motif of a pattern over the scale of a chord quality, with C as the root.
+    Memoized, so a long progression only computes each (quality, pattern) motif once;
+    each chord then transposes it to its root.
+    Parameters:
+    -quality: chord quality, a key of CHORD_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [tuple]
+    Returns: motif [NoteSequence]
+    """
+    return NoteSequence.from_pattern(CHORD_SCALES[quality], pattern, "major")
+
+
+def make_progression_script(progression, pattern, title = None):
+    """
+    Generates a Lilypond script playing a pattern over each chord of a progression,
+    on the scale of the chord's quality.
+    Each distinct motif is written once, as a Lilypond variable, and every chord
+    transposes it to its root, so long tunes stay short.
+    Parameters:
+    -progression: progression as accepted by progression_chords [string or list]
+    -pattern: pattern in diatonic scale degrees [list]
+    -title: heading for the exercise, defaults to the progression name [string]
+    Returns: full Lilypond script [string]
+    """
+    return "".join(iter_progression_script(progression, pattern, title))
+
+
+def iter_progression_script(progression, pattern, title = None):
+    """
+    Yields the Lilypond script of make_progression_script one fragment at a time.
+    Takes the same parameters as make_progression_script.
+    """
+    chords = progression_chords(progression)
+    pattern = tuple(pattern)
+    for _, quality, _ in chords:
+        error = check_pattern_valid(list(pattern), CHORD_SCALES[quality])
+        if error is not None:
+            raise ValueError(error)
+    if title is None:
+        title = progression if isinstance(progression, str) else "Progression"
+    rhythm_val = determine_rhyth_val(pattern)
+
+    yield (LILYPOND_HEADER + '\n\n\\language "english"\n\n#(set-global-staff-size 20)\n' +
+           "\\markup {" + ly_string(title + ": " + " ".join(str(degree) for degree in pattern)) +
+           "}\n")
+
+    # One variable per distinct motif
+    variables = {}
+    for _, quality, _ in chords:
+        if quality not in variables:
+            variables[quality] = "motif" + "".join(word.capitalize()
+                                                   for word in CHORD_NAMES[quality].split())
+            motif = ly_add_slur(chord_motif(quality, pattern).ly())
+            yield (variables[quality] + " = \\relative {" +
+                   ly_list_to_melody(rhythm_val, motif) + "}\n")
+
+    yield "\\new Staff {\n\\cadenzaOn\n"
+    for root, quality, root_ly in chords:
+        # Roots above F# are transposed down, to stay around the octave of the motif
+        yield ("<>^\\markup \\concat {" + LY_TO_TEXT[root_ly] + ' "' + quality + '"} ' +
+               "\\transpose c " + root_ly + ("," if root > 6 else "") + " \\" +
+               variables[quality] + ' \\bar "|"\n')
+    yield '\\bar "|."\n}\n'
+
+
+#---Functions for previews---
+def make_preview_script(name_of_scale, pattern, settings):
+    """
+    Generates a Lilypond script for just the first staff block of the book
+    (the first key, or its first mode), which Lilypond engraves in a fraction
+    of the time of the full book.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    Returns: Lilypond script of the first block [string]
+    """
+    fragments = generate_ly_fragments(name_of_scale, pattern, settings)
+    # The prelude and the first staff block
+    return "".join(itertools.islice(fragments, 2))
+
+
+#---Functions for incremental compilation---
+def iter_ly_fragments(name_of_scale, pattern, settings, per_mode = False):
+    """
+    Splits the Lilypond script of a book into fragments that compile on their own:
+    the header and motif followed by the staff blocks of one key
+    (or of one mode of one key, with per_mode).
+    Parameters:
+    -name_of_scale: the full name of the scale [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -per_mode: give each mode of each key its own fragment, rather than each key;
+    each fragment then starts a new page [bool]
+    Yields: (key in LY format, mode number or None, fragment script) [tuple]
+    """
+    scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual = ly_script_inputs(name_of_scale,
+                                                                              pattern)
+    prelude = ly_script_prelude(motif_let_seq, rhythm_val)
+
+    current_key, blocks = None, []
+    for key, mode, staff_block in iter_ly_staff_blocks(scale_let_seq, rhythm_val, key_sig_qual,
+                                                       name_of_scale, settings):
+        if per_mode:
+            yield key, mode, prelude + staff_block
+            continue
+        if blocks and key != current_key:
+            yield current_key, None, prelude + "".join(blocks)
+            blocks = []
+        current_key = key
+        blocks.append(staff_block)
+    if blocks:
+        yield current_key, None, prelude + "".join(blocks)
+
+
+#---Functions for splitting books into volumes---
+def iter_ly_volumes(name_of_scale, pattern, settings, keys_per_volume = None, page_budget = None):
+    """
+    Splits the Lilypond script of a book into volumes of whole keys that compile on their own,
+    so a huge book (e.g., the chromatic scale with modes) can be engraved in parallel.
+    Volumes hold keys_per_volume keys each, or as many keys as fit in page_budget pages
+    by a rough estimate of the layout; with neither, each key is its own volume.
+    Parameters:
+    -name_of_scale: the full name of the scale [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    -keys_per_volume: keys in each volume [int]
+    -page_budget: estimated pages allowed in each volume [float]
+    Yields: volume with keys keys (in LY format), estimated_pages and script [dict]
+    """
+    scale_let_seq, motif_let_seq, rhythm_val, key_sig_qual = ly_script_inputs(name_of_scale,
+                                                                              pattern)
+    prelude = ly_script_prelude(motif_let_seq, rhythm_val)
+    if not keys_per_volume and not page_budget:
+        keys_per_volume = 1
+
+    # Each staff block is a heading plus the motif repeated from every note of the scale
+    block_pages = (1 + -(-len(scale_let_seq) * len(pattern) // NOTES_PER_SYSTEM)) / SYSTEMS_PER_PAGE
+
+    books = {}
+    for key, _, staff_block in iter_ly_staff_blocks(scale_let_seq, rhythm_val, key_sig_qual,
+                                                    name_of_scale, settings):
+        books.setdefault(key, []).append(staff_block)
+
+    volume = {"keys": [], "estimated_pages": 0.0, "script": prelude}
+    for key, blocks in books.items():
+        key_pages = len(blocks) * block_pages
+        if settings["modes"]:
+            key_pages = float(-(-key_pages // 1)) # Each key ends with a page break
+        if volume["keys"] and ((keys_per_volume and len(volume["keys"]) >= keys_per_volume) or
+                               (page_budget and volume["estimated_pages"] + key_pages > page_budget)):
+            yield volume
+            volume = {"keys": [], "estimated_pages": 0.0, "script": prelude}
+        volume["keys"].append(key)
+        volume["estimated_pages"] += key_pages
+        volume["script"] += "".join(blocks)
+    if volume["keys"]:
+        yield volume
+
+
+#---Functions for non-interactive generation---
+def generate_ly_script(name_of_scale, pattern, settings):
+    """
+    Runs the generation pipeline for a scale and pattern without prompting the user.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    -settings: advanced settings [dict]
+    Returns: full Lilypond script [string]
+    """
+    with trace_stage("make_ly_script") as event:
+        lilypond_script = "".join(generate_ly_fragments(name_of_scale, pattern, settings))
+        event["ly_chars"] = len(lilypond_script)
+    return lilypond_script
+
+
+def generate_ly_fragments(name_of_scale, pattern, settings):
+    """
+    Runs the generation pipeline like generate_ly_script,
+    but yields the Lilypond script in fragments (see iter_ly_script).
+    """
+    return iter_ly_script(*ly_script_inputs(name_of_scale, pattern), name_of_scale, settings)
+
+
+def ly_script_inputs(name_of_scale, pattern):
+    """
+    Works out the inputs of make_ly_script for a scale and pattern.
+    Parameters:
+    -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+    -pattern: pattern in diatonic scale degrees [list]
+    Returns: scale and motif as NoteSequences (spelled in the key quality when the script
+    is written), rhythm value and key quality [tuple]
+    """
+    info = scale_info(name_of_scale)
+
+    # Generating basic sequence and related details
+    with trace_stage("rhythm"):
+        rhythm_val = determine_rhyth_val(pattern)
+        key_sig_qual = info["key_quality"]
+    with trace_stage("motif"):
+        motif_seq = NoteSequence.from_pattern(info["scale"], pattern, key_sig_qual)
+        scale_seq = NoteSequence(info["scale"], key_sig_qual)
+
+    return scale_seq, motif_seq, rhythm_val, key_sig_qual
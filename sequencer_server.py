@@ -0,0 +1,344 @@
+"""
+File: sequencer_server.py
+---
+A local HTTP service for the musical pattern sequencer, so several users can share
+the generation functions and Lilypond without going through the prompts of main().
+
+Endpoints (GET), each taking the query parameters scale, pattern (e.g. 1-2-3-5) and modes (y/n):
+-/ly: Lilypond source
+-/pdf: engraved PDF
+-/png: first page as a PNG image
+-/svg: first page as an SVG image
+-/midi: Standard MIDI File (see make_midi)
+-/musicxml: MusicXML score (see make_musicxml)
+-/bundle: a zip file of several formats, listed in the formats parameter (e.g. pdf,png,svg);
+the engraved ones all come from a single Lilypond run
+-/metrics: per-stage metrics in Prometheus text format (no parameters)
+
+Identical requests that arrive while the first is still being rendered share its result,
+so they cost one Lilypond run. Lilypond runs are limited to --workers at once, and
+once --max-queued runs are waiting, further compile requests get "503 Service Unavailable"
+instead of queueing without limit.
+
+Usage: python sequencer_server.py [--host HOST] [--port PORT] [--workers N] [--max-queued N]
+                                  [--scales FILE]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import os
+import sys
+import urllib.parse
+import zipfile
+
+import musicalpatternsequencer as mps
+
+CONTENT_TYPES = {
+    "ly": "text/plain; charset=utf-8",
+    "pdf": "application/pdf",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "midi": "audio/midi",
+    "musicxml": "application/vnd.recordare.musicxml+xml",
+    "bundle": "application/zip"
+}
+
+DEFAULT_BUNDLE_FORMATS = "ly,pdf,midi"
+
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout"
+}
+
+REQUEST_TIMEOUT = 10 # Seconds allowed for a client to send its request
+MAX_HEADER_LINES = 100
+
+
+class RequestError(Exception):
+    """
+    Error to report to the client, with its HTTP status code.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderService:
+    """
+    Renders books for HTTP requests, sharing in-flight work between identical requests.
+    Parameters:
+    -workers: Lilypond processes to run at once, defaults to the number of cores [int]
+    -max_queued: compile requests allowed to wait for a free worker before new ones
+    are turned away, defaults to 4 per worker [int]
+    -max_connections: connections handled at once; further connections are turned away [int]
+    -timeout: seconds to allow each Lilypond run [float]
+    """
+    def __init__(self, workers = None, max_queued = None, max_connections = 256, timeout = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = 4 * self.workers if max_queued is None else max_queued
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers,
+                                                              thread_name_prefix="lilypond")
+        self.in_flight = {} # (cache key, format): task rendering it
+        self.compiles = 0 # Lilypond runs waiting or running
+        self.connections = 0
+        self.metrics = mps.MetricsCollector()
+        mps.add_hook(self.metrics)
+
+    def close(self):
+        """
+        Stops collecting metrics and waits for running Lilypond processes.
+        """
+        mps.remove_hook(self.metrics)
+        self.executor.shutdown(wait=True)
+
+    async def render(self, name_of_scale, pattern, settings, formats):
+        """
+        Renders a book, or waits for an identical render that is already in progress.
+        Parameters:
+        -name_of_scale: the full name of the scale, a key of ALLOWED_SCALES [string]
+        -pattern: pattern in diatonic scale degrees [list]
+        -settings: advanced settings [dict]
+        -formats: output formats, keys of FORMAT_EXTENSIONS [tuple]
+        Returns: output files, named score.<extension> (file name: contents) [dict]
+        """
+        key = (mps.cache_key(name_of_scale, pattern, settings), formats)
+        task = self.in_flight.get(key)
+        if task is not None:
+            mps.emit_event("coalesced", format=",".join(formats))
+        else:
+            task = asyncio.ensure_future(self.render_new(name_of_scale, pattern, settings,
+                                                         formats))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shielded, so a client hanging up does not cancel the render for everyone else
+        return await asyncio.shield(task)
+
+    async def render_new(self, name_of_scale, pattern, settings, formats):
+        """
+        Renders a book (see render_formats), off the event loop. Generating the Lilypond
+        source, MIDI or MusicXML can still take tens of milliseconds (e.g. chromatic with
+        modes), so it runs in the loop's default thread pool, where it does not wait
+        behind Lilypond runs; books that need Lilypond go to the Lilypond workers.
+        Returns: output files (file name: contents) [dict]
+        """
+        if not any(output_format in mps.ENGRAVED_FORMATS for output_format in formats):
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, mps.render_formats, name_of_scale, pattern, settings, formats)
+            return result["files"]
+
+        if self.compiles >= self.max_queued + self.workers:
+            mps.emit_event("rejected", format=",".join(formats))
+            raise RequestError(503, "Too many books waiting for Lilypond, try again shortly.")
+        self.compiles += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, mps.render_formats, name_of_scale, pattern, settings, formats,
+                None, "score", self.timeout)
+        finally:
+            self.compiles -= 1
+
+        if result["status"] == "timeout":
+            raise RequestError(504, "Lilypond timed out.")
+        if result["status"] != "ok":
+            error = result["error"] or {"type": "failed", "message": "no output"}
+            raise RequestError(500, "Lilypond " + error["type"].replace("_", " ") + ": " +
+                               error["message"])
+        return result["files"]
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers one HTTP request per connection.
+        """
+        if self.connections >= self.max_connections:
+            await send_response(writer, 503, b"Too many connections, try again shortly.\n",
+                                headers={"Retry-After": "1"})
+            return
+        self.connections += 1
+        method = "GET"
+        try:
+            try:
+                method, target = await asyncio.wait_for(read_request(reader), REQUEST_TIMEOUT)
+                status, body, headers = await self.respond(method, target)
+            except RequestError as error:
+                status, body = error.status, (str(error) + "\n").encode("utf-8")
+                headers = {"Retry-After": "1"} if error.status == 503 else {}
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+                return
+            except Exception as error:
+                # Any other failure still answers, so the client is not left waiting
+                print("Error answering a request: " + repr(error), file=sys.stderr)
+                status, body, headers = 500, b"Internal server error.\n", {}
+            await send_response(writer, status, body, headers, head_only=method == "HEAD")
+        finally:
+            self.connections -= 1
+
+    async def respond(self, method, target):
+        """
+        Works out the response to a request.
+        Parameters:
+        -method: HTTP method [string]
+        -target: request target, e.g. /pdf?scale=major&pattern=1-2-3-5 [string]
+        Returns: status code, body and extra headers [tuple]
+        """
+        if method not in ("GET", "HEAD"):
+            raise RequestError(405, "Only GET requests are supported.")
+        url = urllib.parse.urlsplit(target)
+        endpoint = url.path.strip("/")
+
+        if endpoint == "metrics":
+            return 200, self.metrics.to_prometheus().encode("utf-8"), {
+                "Content-Type": "text/plain; version=0.0.4"}
+        if endpoint not in CONTENT_TYPES:
+            raise RequestError(404, "Unknown endpoint: /" + endpoint)
+
+        query = urllib.parse.parse_qs(url.query)
+        job = query_to_job(query)
+        if endpoint == "bundle":
+            formats = query.get("formats", [DEFAULT_BUNDLE_FORMATS])[0].replace(",", " ").split()
+            unknown = [output_format for output_format in formats
+                       if output_format not in mps.FORMAT_EXTENSIONS]
+            if unknown or not formats:
+                raise RequestError(400, "Unknown output format: " + ", ".join(unknown))
+            formats = tuple(sorted(set(formats)))
+        else:
+            formats = (endpoint,)
+        files = await self.render(job["scale"], job["pattern"], job["settings"], formats)
+
+        if endpoint == "bundle":
+            body = zip_files({job["name"] + name[len("score"):]: data
+                              for name, data in files.items()})
+            extension = ".zip"
+        else:
+            extension = mps.FORMAT_EXTENSIONS[endpoint]
+            # A multi-page PNG gives score-page1.png first
+            outputs = sorted(name for name in files if name.endswith(extension))
+            if not outputs:
+                raise RequestError(500, "Lilypond failed: no output")
+            body = files[outputs[0]]
+        return 200, body, {
+            "Content-Type": CONTENT_TYPES[endpoint],
+            "Content-Disposition": 'inline; filename="' + job["name"] + extension + '"'}
+
+
+def query_to_job(query):
+    """
+    Reads and checks the scale, pattern and settings of a request.
+    Parameter: parsed query string, as from urllib.parse.parse_qs [dict]
+    Returns: job as from manifest_row_to_job [dict]
+    """
+    if "scale" not in query or "pattern" not in query:
+        raise RequestError(400, "The scale and pattern parameters are required.")
+    modes = query.get("modes", ["n"])[0].strip().lower() in ("y", "yes", "true", "1")
+    job = mps.manifest_row_to_job({"scale": query["scale"][0],
+                                   "pattern": query["pattern"][0].replace("-", " "),
+                                   "settings": {"modes": modes}})
+    if job["scale"] not in mps.ALLOWED_SCALES:
+        raise RequestError(400, "Unknown scale: " + job["scale"])
+    error = mps.check_pattern_valid(job["pattern"], mps.ALLOWED_SCALES[job["scale"]])
+    if error is not None:
+        raise RequestError(400, error)
+    return job
+
+
+def zip_files(files):
+    """
+    Packs files into a zip archive in memory.
+    Parameter: files to pack (file name: contents) [dict]
+    Returns: contents of the zip file [bytes]
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in sorted(files.items()):
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+async def read_request(reader):
+    """
+    Reads the request line and headers of an HTTP request.
+    Returns: method and request target [tuple]
+    """
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) != 3:
+        raise RequestError(400, "Malformed request.")
+    for _ in range(MAX_HEADER_LINES):
+        if (await reader.readline()) in (b"\r\n", b"\n", b""):
+            return request_line[0], request_line[1]
+    raise RequestError(400, "Too many headers.")
+
+
+async def send_response(writer, status, body, headers = None, head_only = False):
+    """
+    Writes an HTTP response and closes the connection.
+    """
+    lines = ["HTTP/1.1 " + str(status) + " " + STATUS_REASONS[status],
+             "Content-Length: " + str(len(body)),
+             "Connection: close"]
+    headers = dict({"Content-Type": "text/plain; charset=utf-8"}, **(headers or {}))
+    lines += [name + ": " + value for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    if not head_only:
+        writer.write(body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, service):
+    """
+    Runs the service until it is interrupted.
+    """
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print("Serving on http://" + host + ":" + str(port))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv):
+    """
+    Entry point for the service.
+    Parameter: command line arguments, without the program name [list]
+    """
+    parser = argparse.ArgumentParser(description="Serve the musical pattern sequencer over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Lilypond processes to run at once (default: number of cores)")
+    parser.add_argument("--max-queued", type=int, default=None,
+                        help="compile requests allowed to wait for a worker (default: 4 per worker)")
+    parser.add_argument("--max-connections", type=int, default=256,
+                        help="connections to handle at once")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds to allow each Lilypond run")
+    parser.add_argument("--scales", help="CSV, JSON or YAML list of custom scales to serve "
+                                         "(see read_scales)")
+    args = parser.parse_args(argv)
+    if args.scales:
+        try:
+            mps.read_scales(args.scales)
+        except (KeyError, ValueError) as error:
+            parser.error("--scales: " + str(error))
+
+    service = RenderService(args.workers, args.max_queued, args.max_connections, args.timeout)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,144 @@
+"""
+File: sequencer_tracing.py
+---
+Hooks for tracing each stage of the musical pattern sequencer,
+and a collector that turns the events into metrics.
+"""
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# Callbacks receiving an event dict for each pipeline stage (see add_hook)
+PIPELINE_HOOKS = []
+
+
+#---Functions for tracing the pipeline---
+def add_hook(hook):
+    """
+    Registers a callback that receives an event for each pipeline stage.
+    Events are dicts with at least the keys stage and time; timed stages add duration
+    (seconds) and error (message or None), plus stage-specific details such as
+    ly_chars, pdf_bytes, returncode and stderr.
+    Hooks may be called from several threads at once when compiling in parallel.
+    Parameter: hook, called with each event [function]
+    """
+    PIPELINE_HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregisters a callback added with add_hook.
+    """
+    PIPELINE_HOOKS.remove(hook)
+
+
+def emit_event(stage, **details):
+    """
+    Sends an event to every registered hook.
+    Parameters:
+    -stage: name of the stage or counter, e.g. "lilypond" or "cache_hit" [string]
+    -details: extra fields for the event
+    """
+    if not PIPELINE_HOOKS:
+        return
+    event = dict(details, stage=stage, time=time.time())
+    for hook in list(PIPELINE_HOOKS):
+        hook(event)
+
+
+@contextlib.contextmanager
+def trace_stage(stage, **details):
+    """
+    Times the code in a with block and emits it as a pipeline stage.
+    The block can add details to the yielded dict, e.g. output sizes.
+    Usage: with trace_stage("make_ly_script") as event: event["ly_chars"] = ...
+    """
+    details["error"] = None
+    start = time.perf_counter()
+    try:
+        yield details
+    except Exception as error:
+        details["error"] = str(error)
+        raise
+    finally:
+        emit_event(stage, duration=time.perf_counter() - start, **details)
+
+
+class MetricsCollector:
+    """
+    Pipeline hook that aggregates events into metrics:
+    per-stage counts and durations, output sizes, Lilypond exit codes, errors
+    and counters for events without a duration.
+    Usage: collector = MetricsCollector(); add_hook(collector); ...; collector.to_prometheus()
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {} # stage: {"count", "errors", "seconds", "max_seconds"}
+        self.events = collections.Counter()
+        self.totals = collections.Counter() # e.g. ly_chars, pdf_bytes
+        self.exit_codes = collections.Counter()
+        self.last_stderr = ""
+
+    def __call__(self, event):
+        with self.lock:
+            if "duration" not in event: # Plain counter, e.g. cache_hit
+                self.events[event["stage"]] += 1
+                return
+            stage = self.stages.setdefault(event["stage"], {"count": 0, "errors": 0,
+                                                            "seconds": 0.0, "max_seconds": 0.0})
+            stage["count"] += 1
+            if event.get("error"):
+                stage["errors"] += 1
+            stage["seconds"] += event["duration"]
+            stage["max_seconds"] = max(stage["max_seconds"], event["duration"])
+            for size in ("ly_chars", "pdf_bytes"):
+                self.totals[size] += event.get(size) or 0
+            if "returncode" in event:
+                self.exit_codes[str(event["returncode"])] += 1
+                if event.get("stderr") and event["returncode"] != 0:
+                    self.last_stderr = event["stderr"]
+
+    def to_dict(self):
+        """
+        Returns: snapshot of the metrics [dict]
+        """
+        with self.lock:
+            return {"stages": {stage: dict(values) for stage, values in self.stages.items()},
+                    "events": dict(self.events), "totals": dict(self.totals),
+                    "lilypond_exit_codes": dict(self.exit_codes),
+                    "last_lilypond_stderr": self.last_stderr}
+
+    def to_json(self):
+        """
+        Returns: the metrics as JSON [string]
+        """
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Returns: the metrics in the Prometheus text exposition format [string]
+        """
+        metrics = self.to_dict()
+        lines = ["# TYPE sequencer_stage_seconds summary"]
+        for stage, values in sorted(metrics["stages"].items()):
+            lines.append('sequencer_stage_seconds_count{stage="' + stage + '"} ' +
+                         str(values["count"]))
+            lines.append('sequencer_stage_seconds_sum{stage="' + stage + '"} ' +
+                         repr(values["seconds"]))
+        lines.append("# TYPE sequencer_stage_errors_total counter")
+        for stage, values in sorted(metrics["stages"].items()):
+            lines.append('sequencer_stage_errors_total{stage="' + stage + '"} ' +
+                         str(values["errors"]))
+        lines.append("# TYPE sequencer_events_total counter")
+        for name, count in sorted(metrics["events"].items()):
+            lines.append('sequencer_events_total{event="' + name + '"} ' + str(count))
+        for size, total in sorted(metrics["totals"].items()):
+            lines.append("# TYPE sequencer_" + size + "_total counter")
+            lines.append("sequencer_" + size + "_total " + str(total))
+        lines.append("# TYPE sequencer_lilypond_exit_total counter")
+        for code, count in sorted(metrics["lilypond_exit_codes"].items()):
+            lines.append('sequencer_lilypond_exit_total{code="' + code + '"} ' + str(count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,147 @@
+"""
+File: test_sequencer_compile.py
+---
+Tests the circuit breaker that batch compiles share (see CircuitBreaker), without Lilypond:
+opening after failures in a row, the one trial run after a cool-down, and the trial
+ticket being released when a compile raises.
+
+Usage: python -m pytest test_sequencer_compile.py (or python -m unittest)
+"""
+import threading
+import unittest
+from unittest import mock
+
+import sequencer_compile
+from sequencer_compile import CircuitBreaker, compile_with_retry
+
+COOLDOWN = 0.05 # Seconds, kept short so the tests run quickly
+WAIT = 5.0 # Longest a test waits on another thread before failing
+
+
+def make_breaker(**options):
+    """
+    Returns: a breaker opening after two failures, with a short cool-down [CircuitBreaker]
+    """
+    return CircuitBreaker(**dict({"failure_threshold": 2, "cooldown": COOLDOWN,
+                                  "max_cooldown": COOLDOWN, "max_trips": 3}, **options))
+
+
+def open_breaker(breaker):
+    """
+    Fails enough runs in a row to open the breaker.
+    """
+    for _ in range(breaker.failure_threshold):
+        breaker.record({"status": "crashed"}, breaker.allow())
+
+
+def allow_in_thread(breaker):
+    """
+    Calls allow() from another thread.
+    Returns: the thread and a list that receives its ticket [tuple]
+    """
+    tickets = []
+    thread = threading.Thread(target=lambda: tickets.append(breaker.allow()), daemon=True)
+    thread.start()
+    return thread, tickets
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_failures_in_a_row(self):
+        breaker = make_breaker()
+        breaker.record({"status": "crashed"}, breaker.allow())
+        self.assertEqual(breaker.state, "closed")
+        breaker.record({"status": "timeout"}, breaker.allow())
+        self.assertEqual(breaker.state, "open")
+        self.assertEqual(breaker.trips, 1)
+
+    def test_failed_documents_do_not_count(self):
+        breaker = make_breaker()
+        for _ in range(5):
+            breaker.record({"status": "failed"}, breaker.allow())
+        self.assertEqual(breaker.state, "closed")
+
+    def test_failures_under_way_while_open_do_not_trip_again(self):
+        breaker = make_breaker()
+        open_breaker(breaker)
+        for _ in range(5):
+            breaker.record({"status": "crashed"}, {"trial": False})
+        self.assertEqual(breaker.trips, 1)
+
+    def test_one_trial_then_success_closes(self):
+        breaker = make_breaker()
+        open_breaker(breaker)
+        ticket = breaker.allow() # Waits out the cool-down
+        self.assertEqual(ticket, {"trial": True})
+        self.assertEqual(breaker.state, "half-open")
+
+        thread, tickets = allow_in_thread(breaker)
+        thread.join(COOLDOWN * 4)
+        self.assertTrue(thread.is_alive(), "a second run went ahead during the trial")
+
+        breaker.record({"status": "ok"}, ticket)
+        thread.join(WAIT)
+        self.assertEqual(tickets, [{"trial": False}])
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.trips, 0)
+
+    def test_failed_trial_opens_again(self):
+        breaker = make_breaker()
+        open_breaker(breaker)
+        ticket = breaker.allow()
+        breaker.record({"status": "crashed"}, ticket)
+        self.assertEqual(breaker.trips, 2)
+        self.assertEqual(breaker.allow(), {"trial": True}) # The trial lock was released
+
+    def test_gives_up_after_max_trips(self):
+        breaker = make_breaker(max_trips=1)
+        open_breaker(breaker)
+        breaker.record({"status": "crashed"}, breaker.allow())
+        self.assertEqual(breaker.state, "gave up")
+        self.assertIs(breaker.allow(), False)
+
+
+class CompileWithRetryBreakerTest(unittest.TestCase):
+
+    def assert_trial_released(self, breaker):
+        """
+        Checks that a failed trial was counted and another run can take the next trial.
+        """
+        self.assertEqual(breaker.trips, 2)
+        thread, tickets = allow_in_thread(breaker)
+        thread.join(WAIT)
+        self.assertEqual(tickets, [{"trial": True}])
+        breaker.record({"status": "ok"}, tickets[0])
+
+    def test_trial_released_when_source_raises(self):
+        breaker = make_breaker()
+        open_breaker(breaker)
+
+        def broken_source():
+            raise ValueError("could not generate the script")
+
+        with self.assertRaises(ValueError):
+            compile_with_retry("score.ly", source=broken_source, breaker=breaker)
+        self.assert_trial_released(breaker)
+
+    def test_trial_released_when_lilypond_raises(self):
+        breaker = make_breaker()
+        open_breaker(breaker)
+        with mock.patch.object(sequencer_compile, "run_lilypond",
+                               side_effect=OSError("no space left on device")):
+            with self.assertRaises(OSError):
+                compile_with_retry("score.ly", breaker=breaker)
+        self.assert_trial_released(breaker)
+
+    def test_success_recorded(self):
+        breaker = make_breaker()
+        open_breaker(breaker)
+        with mock.patch.object(sequencer_compile, "run_lilypond",
+                               return_value={"status": "ok", "file": "score.ly"}):
+            result = compile_with_retry("score.ly", breaker=breaker)
+        self.assertEqual(result["attempts"], 1)
+        self.assertEqual(breaker.state, "closed")
+
+
+if __name__ == '__main__':
+    unittest.main()